@@ -0,0 +1,60 @@
+########################################################################
+#                                                                      #
+#          NAME:  PiERS Chat - Adaptive Data Rate                      #
+#  DEVELOPED BY:  Chris Clement (K7CTC)                                #
+#       VERSION:  v2.0 (beta)                                          #
+#                                                                      #
+########################################################################
+
+########################################################################
+# ADR Notes:  A LoRa receiver can only demodulate the spreading factor #
+#             it is tuned to, so a node that wants to transmit faster  #
+#             than the fleet's base spreading factor first announces   #
+#             the rate in a beacon sent at the base spreading factor.  #
+#             Receivers tune to the announced rate during that node's  #
+#             time slot until the announcement expires, then return to #
+#             the base rate.  The rate is chosen from the SNR of       #
+#             recent frames received from each peer (assuming the      #
+#             link is roughly symmetric), keeping a margin above the   #
+#             demodulation floor of the chosen spreading factor.  If   #
+#             any known peer has gone quiet the base rate is used.     #
+########################################################################
+
+#import from standard library
+from collections import deque
+from statistics import median
+
+if __name__ == '__main__':
+    print('ERROR: adr.py is not intended for direct execution!')
+
+#lowest SNR (dB) at which each spreading factor can be demodulated
+SNR_FLOOR = {7: -7.5, 8: -10.0, 9: -12.5, 10: -15.0, 11: -17.5, 12: -20.0}
+
+#number of recent frames per peer used to estimate link quality
+HISTORY_LENGTH = 8
+
+#function: choose the fastest spreading factor every peer can receive
+# accepts: dict of peer to (list of recent snr, time last heard), current
+#          time, base spreading factor, margin (dB) and peer timeout (ms)
+# returns: spreading factor
+def choose_sf(peers, now, base_sf, margin, peer_timeout):
+    if not peers:
+        return base_sf
+    worst_snr = None
+    for snr_history, last_heard in peers.values():
+        if now - last_heard > peer_timeout or not snr_history:
+            return base_sf #fall back on loss
+        peer_snr = median(snr_history)
+        if worst_snr == None or peer_snr < worst_snr:
+            worst_snr = peer_snr
+    for sf in range(7, base_sf):
+        if SNR_FLOOR[sf] + margin <= worst_snr:
+            return sf
+    return base_sf
+
+#function: record the snr of a frame received from a peer
+# accepts: dict of peers (see choose_sf), peer, snr and time received
+def record_snr(peers, peer, snr, now):
+    snr_history, last_heard = peers.get(peer, (deque(maxlen=HISTORY_LENGTH), now))
+    snr_history.append(snr)
+    peers[peer] = (snr_history, now)
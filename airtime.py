@@ -0,0 +1,74 @@
+########################################################################
+#                                                                      #
+#          NAME:  PiERS Chat - Time-on-Air Functions                   #
+#  DEVELOPED BY:  Chris Clement (K7CTC)                                #
+#       VERSION:  v2.0 (beta)                                          #
+#                                                                      #
+########################################################################
+
+########################################################################
+# Time-on-Air Notes:  Air time is predicted with the LoRa modem        #
+#                     formula from Semtech application note AN1200.13  #
+#                     using the radio settings in lostik_settings.py.  #
+#                     Run this module directly to compare predictions  #
+#                     against the air time measured by the LoStik      #
+#                     Service and stored in piers.db.                  #
+########################################################################
+
+#import from project library
+import lostik_settings
+
+#import from standard library
+from math import ceil
+
+SF = int(lostik_settings.SET_SF.decode('ASCII').lstrip('sf'))
+BW = int(lostik_settings.SET_BW.decode('ASCII')) * 1000
+CR = int(lostik_settings.SET_CR.decode('ASCII').split('/')[1]) - 4
+
+#function: compute LoRa time-on-air
+# accepts: payload length in bytes and optionally the radio settings
+# returns: time-on-air in milliseconds
+def time_on_air(payload_length, sf=SF, bw=BW, cr=CR,
+                preamble_length=lostik_settings.PREAMBLE_LENGTH,
+                crc=lostik_settings.CRC,
+                explicit_header=lostik_settings.EXPLICIT_HEADER):
+    symbol_time = (2 ** sf) / bw * 1000
+    #low data rate optimization is mandated for symbol times above 16 ms
+    low_data_rate_optimize = 1 if symbol_time > 16 else 0
+    preamble_time = (preamble_length + 4.25) * symbol_time
+    payload_symbols = 8 + max(ceil((8 * payload_length - 4 * sf + 28 + 16 * crc - 20 * (not explicit_header))
+                                   / (4 * (sf - 2 * low_data_rate_optimize))) * (cr + 4), 0)
+    return preamble_time + payload_symbols * symbol_time
+
+if __name__ == '__main__':
+    #import from project library
+    import db
+    import frames
+
+    if lostik_settings.FRAME_ENCODING == 'ascii':
+        frame_type = frames.FRAME_DATA_ASCII
+    else:
+        frame_type = frames.FRAME_DATA_PACKED
+
+    #messages sent in the same frame share time_sent, rebuild each frame from them
+    sent_frames = {}
+    for message, time_sent, air_time, sf in db.connection.execute('''
+            SELECT message, time_sent, air_time, sf FROM messages
+            WHERE time_sent IS NOT NULL AND air_time IS NOT NULL
+            ORDER BY rowid'''):
+        messages, measured, sf = sent_frames.get(time_sent, ([], 0, sf or SF))
+        sent_frames[time_sent] = (messages + [message], measured + air_time, sf)
+
+    if not sent_frames:
+        print('No transmitted frames found in piers.db.')
+    else:
+        errors = []
+        print('  SF   Length   Predicted    Measured     Error')
+        for messages, measured, sf in sent_frames.values():
+            length = len(frames.pack_data_frame(0, messages, frame_type))
+            predicted = time_on_air(length, sf=sf)
+            errors.append(measured - predicted)
+            print(f'{sf:>4} {length:>8}  {predicted:>8.0f}ms  {measured:>8.0f}ms  {measured - predicted:>+6.0f}ms')
+        errors.sort()
+        print(f'{len(errors)} frames, median error {errors[len(errors) // 2]:+.0f}ms, '
+              f'range {errors[0]:+.0f}ms to {errors[-1]:+.0f}ms')
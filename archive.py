@@ -0,0 +1,309 @@
+########################################################################
+#                                                                      #
+#          NAME:  PiERS Chat - Message Archive                         #
+#  DEVELOPED BY:  Chris Clement (K7CTC)                                #
+#       VERSION:  v2.0 (beta)                                          #
+#                                                                      #
+########################################################################
+
+########################################################################
+# Archive Notes:  piers.db holds only queued messages and those sent   #
+#                 or received within HOT_RETENTION, so the tables and  #
+#                 indexes every process works with stay small.  Older  #
+#                 messages are moved into one archive database per day #
+#                 or month (ARCHIVE_PARTITION) in ARCHIVE_DIRECTORY,   #
+#                 keeping their rowid so that message_history.py can   #
+#                 page from piers.db into the archives and back.       #
+#                                                                      #
+#                 Compaction runs on a worker thread of the LoStik     #
+#                 Service with its own connection and moves at most    #
+#                 COMPACTION_BATCH messages per transaction, so the    #
+#                 radio is never held up waiting for piers.db.  A copy #
+#                 into an archive is idempotent, a batch interrupted   #
+#                 between the archive and piers.db is simply moved     #
+#                 again.  Pages freed in piers.db are reused by new    #
+#                 messages, so the file stops growing.  Archives are   #
+#                 compressed ARCHIVE_COMPRESS_AFTER days after their   #
+#                 day or month ends and deleted after                  #
+#                 ARCHIVE_RETENTION days.  A compressed archive is     #
+#                 read from a temporary copy when paged into.          #
+#                                                                      #
+#                 The newest message is never archived, sqlite would   #
+#                 otherwise reuse rowids once piers.db is emptied, nor #
+#                 is the newest message sent with a sequence number,   #
+#                 which reliable delivery resumes from on restart.     #
+########################################################################
+
+#import from project library
+import lostik_settings
+
+#import from standard library
+from datetime import datetime, timedelta
+import atexit
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+if __name__ == '__main__':
+    print('ERROR: archive.py is not intended for direct execution!')
+
+#time a message belongs to: received, queued or (for old rows) sent
+PARTITION_KEY = 'COALESCE(time_received, time_queued, time_sent)'
+
+#messages settled for longer than HOT_RETENTION, other than the newest and
+#the newest sent with a sequence number (see db.last_sequence)
+ARCHIVABLE = '''
+    (time_received IS NOT NULL OR time_sent IS NOT NULL)
+    AND COALESCE(time_received, time_sent) < :cutoff
+    AND rowid < (SELECT max(rowid) FROM main.messages)
+    AND rowid IS NOT (SELECT max(rowid) FROM main.messages WHERE sequence IS NOT NULL)'''
+
+#function: determine the partition a message belongs to
+# accepts: time (ms)
+# returns: partition name, 2026-10-18 or 2026-10
+def partition(t):
+    date = datetime.fromtimestamp(t / 1000)
+    if lostik_settings.ARCHIVE_PARTITION == 'month':
+        return date.strftime('%Y-%m')
+    return date.strftime('%Y-%m-%d')
+
+#function: obtain the period covered by a partition
+# accepts: partition name
+# returns: start and end (datetime)
+def partition_period(name):
+    fields = [int(field) for field in name.split('-')]
+    if len(fields) == 2:
+        year, month = fields
+        return datetime(year, month, 1), datetime(year + month // 12, month % 12 + 1, 1)
+    start = datetime(*fields)
+    return start, start + timedelta(days=1)
+
+#function: obtain the path of the archive database of a partition
+# accepts: partition name
+# returns: path (uncompressed)
+def archive_path(name):
+    return os.path.join(lostik_settings.ARCHIVE_DIRECTORY, f'piers-{name}.db')
+
+#function: list the archives
+# returns: dict of partition name to path (compressed or not)
+#    note: an archive part way through compression is listed uncompressed
+def archives():
+    paths = {}
+    if not os.path.isdir(lostik_settings.ARCHIVE_DIRECTORY):
+        return paths
+    for filename in sorted(os.listdir(lostik_settings.ARCHIVE_DIRECTORY), reverse=True):
+        for extension in ('.db', '.db.gz'):
+            if filename.startswith('piers-') and filename.endswith(extension):
+                name = filename[len('piers-'):-len(extension)]
+                try:
+                    partition_period(name)
+                except (ValueError, TypeError):
+                    continue
+                paths[name] = os.path.join(lostik_settings.ARCHIVE_DIRECTORY, filename)
+    return paths
+
+#function: compress a file with gzip and remove the original
+# accepts: path
+def compress(path):
+    with open(path, 'rb') as source, gzip.open(path + '.gz.tmp', 'wb') as destination:
+        shutil.copyfileobj(source, destination)
+    os.replace(path + '.gz.tmp', path + '.gz')
+    os.remove(path)
+
+#function: decompress a file compressed with compress()
+# accepts: path (without .gz) and path of the copy to write
+def decompress(path, copy_path):
+    with gzip.open(path + '.gz', 'rb') as source, open(copy_path + '.tmp', 'wb') as destination:
+        shutil.copyfileobj(source, destination)
+    os.replace(copy_path + '.tmp', copy_path)
+
+#function: move old messages out of piers.db into the archives and apply
+#          the retention policy
+# accepts: time (ms), None for now
+# returns: number of messages archived
+#    note: blocking, run on a worker thread (opens its own connection)
+def compact(now=None):
+    if now == None:
+        now = int(round(time.time()*1000))
+    cutoff = now - lostik_settings.HOT_RETENTION
+    os.makedirs(lostik_settings.ARCHIVE_DIRECTORY, exist_ok=True)
+    connection = sqlite3.connect('piers.db', timeout=10)
+    archived = 0
+    try:
+        columns = connection.execute('PRAGMA main.table_info(messages)').fetchall()
+        column_list = ', '.join(column[1] for column in columns)
+        while True:
+            first = connection.execute(f'SELECT min({PARTITION_KEY}) FROM main.messages WHERE {ARCHIVABLE}',
+                                       {'cutoff': cutoff}).fetchone()[0]
+            if first == None:
+                break
+            name = partition(first)
+            partition_end = int(partition_period(name)[1].timestamp() * 1000)
+            path = archive_path(name)
+            if os.path.exists(path + '.gz') and not os.path.exists(path):
+                #a message arrived late for a partition already compressed
+                decompress(path, path)
+                os.remove(path + '.gz')
+            connection.execute('ATTACH DATABASE ? AS archive', (path,))
+            try:
+                connection.execute(f'''CREATE TABLE IF NOT EXISTS archive.messages
+                                       ({", ".join(f"{column[1]} {column[2]}" for column in columns)})''')
+                archive_columns = {column[1] for column in connection.execute('PRAGMA archive.table_info(messages)')}
+                for column in columns:
+                    if column[1] not in archive_columns:
+                        connection.execute(f'ALTER TABLE archive.messages ADD COLUMN {column[1]} {column[2]}')
+                connection.commit()
+                connection.execute('BEGIN IMMEDIATE')
+                last = connection.execute(f'''
+                    SELECT
+                        max(rowid)
+                    FROM
+                        (SELECT rowid FROM main.messages
+                         WHERE {ARCHIVABLE} AND {PARTITION_KEY} < :end
+                         ORDER BY rowid LIMIT :limit)''',
+                    {'cutoff': cutoff, 'end': partition_end, 'limit': lostik_settings.COMPACTION_BATCH}).fetchone()[0]
+                selection = f'{ARCHIVABLE} AND {PARTITION_KEY} < :end AND rowid <= :last'
+                parameters = {'cutoff': cutoff, 'end': partition_end, 'last': last}
+                connection.execute(f'''
+                    INSERT OR REPLACE INTO archive.messages (rowid, {column_list})
+                        SELECT rowid, {column_list} FROM main.messages WHERE {selection}''',
+                    parameters)
+                archived += connection.execute(f'DELETE FROM main.messages WHERE {selection}', parameters).rowcount
+                connection.commit()
+            finally:
+                connection.rollback()
+                connection.execute('DETACH DATABASE archive')
+        apply_retention(now)
+    finally:
+        connection.close()
+    return archived
+
+#function: compress and delete archives as set by the retention policy
+# accepts: time (ms)
+def apply_retention(now):
+    now = datetime.fromtimestamp(now / 1000)
+    for name, path in archives().items():
+        partition_end = partition_period(name)[1]
+        if (lostik_settings.ARCHIVE_RETENTION != None
+                and now - partition_end >= timedelta(days=lostik_settings.ARCHIVE_RETENTION)):
+            os.remove(path)
+        elif (lostik_settings.ARCHIVE_COMPRESS_AFTER != None and not path.endswith('.gz')
+                and now - partition_end >= timedelta(days=lostik_settings.ARCHIVE_COMPRESS_AFTER)):
+            compress(path)
+
+connections = {}  #path to connection of the archives read so far
+
+#function: obtain a connection to an archive for reading
+# accepts: path
+# returns: connection
+def connect(path):
+    if path not in connections:
+        if path.endswith('.gz'):
+            handle, copy_path = tempfile.mkstemp(suffix='.db')
+            os.close(handle)
+            atexit.register(os.remove, copy_path)
+            decompress(path[:-len('.gz')], copy_path)
+        else:
+            copy_path = path
+        connections[path] = sqlite3.connect(copy_path, timeout=10)
+    return connections[path]
+
+#function: build the select list of a history query on an archive
+# accepts: connection and columns wanted
+# returns: select list, NULL for columns the archive predates
+def select_list(connection, columns):
+    archive_columns = {column[1] for column in connection.execute('PRAGMA table_info(messages)')}
+    return ', '.join(column if column == 'rowid' or column in archive_columns else 'NULL' for column in columns)
+
+#function: list the archives in order
+# returns: list of paths, oldest first
+def archive_paths():
+    paths = archives()
+    return [paths[name] for name in sorted(paths, key=lambda name: partition_period(name)[0])]
+
+#function: find the first archive holding messages newer than a rowid
+# accepts: list of archive paths (oldest first) and rowid
+# returns: position in the list, its length if there is none
+#    note: rowids grow with time from one archive to the next, so a binary
+#          search opens (and for a compressed archive decompresses) only a
+#          few of them
+def find_archive(paths, rowid):
+    low, high = 0, len(paths)
+    while low < high:
+        middle = (low + high) // 2
+        newest = connect(paths[middle]).execute('SELECT max(rowid) FROM messages').fetchone()[0]
+        if newest != None and newest > rowid:
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+#function: find the newest archives holding messages newer than a rowid
+# accepts: list of archive paths (oldest first) and rowid
+# returns: position in the list of the first of them, its length if there
+#          are none
+#    note: walks back from the newest archive, so when few archives hold
+#          such messages only those and the one before are opened
+def find_newest_archives(paths, rowid):
+    position = len(paths)
+    while position > 0:
+        newest = connect(paths[position - 1]).execute('SELECT max(rowid) FROM messages').fetchone()[0]
+        if newest != None and newest <= rowid:
+            break
+        position -= 1
+    return position
+
+#function: obtain archived messages older than a rowid
+# accepts: rowid, maximum number of messages, columns wanted and optionally
+#          a rowid the messages must be newer than
+# returns: list of records, oldest first
+def history_before(rowid, limit, columns, newer_than=0):
+    records = []
+    paths = archive_paths()
+    if newer_than == 0:
+        #archives after the one holding rowid hold only newer messages
+        paths = reversed(paths[:find_archive(paths, rowid - 1) + 1])
+    else:
+        paths = reversed(paths[find_newest_archives(paths, newer_than):])
+    for path in paths:
+        if len(records) >= limit:
+            break
+        connection = connect(path)
+        records += connection.execute(f'''
+            SELECT
+                {select_list(connection, columns)}
+            FROM
+                messages
+            WHERE
+                rowid<? AND rowid>?
+            ORDER BY
+                rowid DESC
+            LIMIT ?''',
+            (rowid, newer_than, limit - len(records))).fetchall()
+    return sorted(records, key=lambda record: record[0])
+
+#function: obtain archived messages newer than a rowid
+# accepts: rowid, maximum number of messages and columns wanted
+# returns: list of records, oldest first
+def history_after(rowid, limit, columns):
+    records = []
+    paths = archive_paths()
+    for path in paths[find_archive(paths, rowid):]:
+        if len(records) >= limit:
+            break
+        connection = connect(path)
+        records += connection.execute(f'''
+            SELECT
+                {select_list(connection, columns)}
+            FROM
+                messages
+            WHERE
+                rowid>?
+            ORDER BY
+                rowid
+            LIMIT ?''',
+            (rowid, limit - len(records))).fetchall()
+    return sorted(records, key=lambda record: record[0])[:limit]
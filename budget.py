@@ -0,0 +1,81 @@
+########################################################################
+#                                                                      #
+#          NAME:  PiERS Chat - Air Time Budget                         #
+#  DEVELOPED BY:  Chris Clement (K7CTC)                                #
+#       VERSION:  v2.0 (beta)                                          #
+#                                                                      #
+########################################################################
+
+########################################################################
+# Budget Notes:  Air time is metered with a token bucket holding up to #
+#                one period's worth of air time (for example 360000ms  #
+#                per hour for a 10% duty cycle) and refilled at a      #
+#                steady rate, so a node may burst after a quiet spell  #
+#                but cannot exceed the budget over any rolling period. #
+#                Each transmission is charged its measured air time,   #
+#                which may leave the bucket briefly negative when a    #
+#                frame runs longer than predicted.  A second, per TX   #
+#                window cap limits how much of the channel a node can  #
+#                take in a single time slot.  The bucket is rebuilt on #
+#                start up by replaying the transmissions recorded in   #
+#                piers.db so that restarting the service does not      #
+#                reset the budget.                                     #
+########################################################################
+
+if __name__ == '__main__':
+    print('ERROR: budget.py is not intended for direct execution!')
+
+class AirtimeBudget:
+    #accepts: budget (ms of air time per period), period (ms) and per TX
+    #         window cap (ms)
+    def __init__(self, budget, period, window_cap):
+        if budget <= 0 or period <= 0 or window_cap <= 0:
+            raise ValueError('air time budget, period and window cap must be positive')
+        self.capacity = budget
+        self.refill_rate = budget / period
+        self.window_cap = window_cap
+        self.tokens = budget
+        self.last_update = None
+        self.window_open = None  #TX window the window cap applies to
+        self.window_used = 0
+
+    #function: add the tokens accrued since the last update
+    # accepts: time (ms)
+    def refill(self, now):
+        if self.last_update != None and now > self.last_update:
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_update) * self.refill_rate)
+        if self.last_update == None or now > self.last_update:
+            self.last_update = now
+
+    #function: obtain the air time that may still be used
+    # accepts: time (ms) and opening time of the TX window (ms), None to
+    #          disregard the window cap
+    # returns: air time (ms)
+    def available(self, now, window_open=None):
+        self.refill(now)
+        available = self.tokens
+        if window_open != None:
+            if window_open == self.window_open:
+                available = min(available, self.window_cap - self.window_used)
+            else:
+                available = min(available, self.window_cap)
+        return max(available, 0)
+
+    #function: charge a transmission against the budget
+    # accepts: air time (ms), time (ms) and opening time of the TX window (ms),
+    #          None if not sent in a TX window
+    def consume(self, air_time, now, window_open=None):
+        self.refill(now)
+        self.tokens -= air_time
+        if window_open != None:
+            if window_open != self.window_open:
+                self.window_open = window_open
+                self.window_used = 0
+            self.window_used += air_time
+
+    #function: rebuild the bucket from past transmissions
+    # accepts: list of (time sent, air time) covering at least one period,
+    #          oldest first
+    def replay(self, transmissions):
+        for time_sent, air_time in transmissions:
+            self.consume(air_time, time_sent)
@@ -0,0 +1,60 @@
+########################################################################
+#                                                                      #
+#          NAME:  PiERS Chat - Demand-Assigned TDMA                    #
+#  DEVELOPED BY:  Chris Clement (K7CTC)                                #
+#       VERSION:  v2.0 (beta)                                          #
+#                                                                      #
+########################################################################
+
+########################################################################
+# DAMA Notes:  With static TDMA a node with nothing to send still owns #
+#              its time slot.  In demand-assigned mode every node      #
+#              begins its time slot with a demand frame announcing its #
+#              queue depth, even when idle.  A node that heard the     #
+#              demand of every node during a cycle computes the same   #
+#              schedule for the next cycle as every other such node:   #
+#              time slots of idle nodes (depth 0) are lent in turn to  #
+#              the nodes with a backlog, deepest queue first.  A       #
+#              borrowed time slot still begins with the owner's demand #
+#              frame, the borrower transmits only after it.            #
+#                                                                      #
+#              Lost control information falls back to the static       #
+#              schedule: a node missing any demand for a cycle borrows #
+#              nothing in the next, and an idle node that cannot tell  #
+#              whether its time slot was lent does not transmit in it. #
+#              Two nodes can therefore never both believe they hold    #
+#              the same time slot.                                     #
+########################################################################
+
+if __name__ == '__main__':
+    print('ERROR: dama.py is not intended for direct execution!')
+
+#largest queue depth that can be announced in a demand frame
+MAX_DEPTH = 255
+
+#function: compute the schedule for the next cycle
+# accepts: dict of time slot to announced queue depth (every time slot)
+# returns: dict of time slot to the time slot of the node that will use it
+def allocate(depths):
+    owners = {time_slot: time_slot for time_slot in depths}
+    backlogged = sorted((time_slot for time_slot, depth in depths.items() if depth > 0),
+                        key=lambda time_slot: (-depths[time_slot], time_slot))
+    if not backlogged:
+        return owners
+    idle = sorted(time_slot for time_slot, depth in depths.items() if depth == 0)
+    for index, time_slot in enumerate(idle):
+        owners[time_slot] = backlogged[index % len(backlogged)]
+    return owners
+
+#function: determine the time slots I may transmit data in during a cycle
+# accepts: my time slot, number of time slots and dict of time slot to queue
+#          depth announced during the previous cycle (including mine)
+# returns: set of time slots
+def my_time_slots(my_time_slot, slot_count, depths):
+    if len(depths) == slot_count:
+        owners = allocate(depths)
+        return {time_slot for time_slot, owner in owners.items() if owner == my_time_slot}
+    #incomplete control information, static schedule
+    if depths.get(my_time_slot, 1) > 0:
+        return {my_time_slot}
+    return set()
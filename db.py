@@ -6,83 +6,414 @@
 #                                                                      #
 ########################################################################
 
+#import from project library
+import archive
+import notify
+
 #import from standard library
 import sqlite3
 from time import time
-from pathlib import Path
 
 if __name__ == '__main__':
     print('ERROR: db.py is not intended for direct execution!')
 
-#create db if it doesn't already exist
-if Path('piers.db').is_file() == False:
-    db = sqlite3.connect('piers.db')
-    db.execute('''
-        CREATE TABLE messages (
-            message	        TEXT NOT NULL,
-            time_sent	    INTEGER,
-            air_time	    INTEGER,
-            time_received   INTEGER,
-            rssi            INTEGER,
-            snr             INTEGER
-        )''')
-    db.commit()
-    db.close()
-
-def insert_inbound_message(message,rssi,snr):
+#outbound message priorities
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 1
+PRIORITY_URGENT = 2
+PRIORITY_NAMES = {PRIORITY_LOW: 'low', PRIORITY_NORMAL: 'normal', PRIORITY_URGENT: 'urgent'}
+
+#open a single long-lived connection for the life of the process
+#    note: write-ahead logging lets lostik_service.py, new_message.py and
+#          message_history.py read and write concurrently without blocking
+#          each other, synchronous=NORMAL is durable across application
+#          crashes and avoids an fsync on every commit in WAL mode
+connection = sqlite3.connect('piers.db', timeout=10, cached_statements=32)
+connection.execute('PRAGMA journal_mode=WAL')
+connection.execute('PRAGMA synchronous=NORMAL')
+
+#create messages table if it doesn't already exist
+connection.execute('''
+    CREATE TABLE IF NOT EXISTS messages (
+        message	        TEXT NOT NULL,
+        time_sent	    INTEGER,
+        air_time	    INTEGER,
+        time_received   INTEGER,
+        rssi            INTEGER,
+        snr             INTEGER
+    )''')
+connection.commit()
+
+#schema migrations, applied in order and tracked with PRAGMA user_version
+SCHEMA_MIGRATIONS = [
+    #outbound queue: time_dequeued marks a message as in flight and the
+    #partial index holds only queued rows so dequeue cost does not grow
+    #with message history
+    'ALTER TABLE messages ADD COLUMN time_dequeued INTEGER',
+    '''
+    CREATE INDEX outbound_queue ON messages (time_dequeued)
+        WHERE time_sent IS NULL AND time_received IS NULL''',
+    #sender: time slot of the node that transmitted an inbound message
+    'ALTER TABLE messages ADD COLUMN sender INTEGER',
+    #sf: spreading factor a message was sent or received with
+    'ALTER TABLE messages ADD COLUMN sf INTEGER',
+    #time_queued: time an outbound message was queued by new_message.py
+    'ALTER TABLE messages ADD COLUMN time_queued INTEGER',
+    #priority: see PRIORITY_LOW, PRIORITY_NORMAL and PRIORITY_URGENT
+    'ALTER TABLE messages ADD COLUMN priority INTEGER',
+    #sequence: sequence number of the frame an outbound message was sent in
+    #with reliable delivery, time_acked: time every peer acknowledged it
+    'ALTER TABLE messages ADD COLUMN sequence INTEGER',
+    'ALTER TABLE messages ADD COLUMN time_acked INTEGER',
+    #fragments_sent: fragments of a long outbound message sent in earlier TX
+    #windows, while the rest wait in the queue
+    'ALTER TABLE messages ADD COLUMN fragments_sent INTEGER',
+    #radio and frequency: EUI-64 of the LoStik a message was sent or received
+    #with and its frequency (Hz), see --multi-radio in lostik_service.py
+    'ALTER TABLE messages ADD COLUMN radio TEXT',
+    'ALTER TABLE messages ADD COLUMN frequency INTEGER',
+]
+
+connection.execute('BEGIN IMMEDIATE')
+user_version = connection.execute('PRAGMA user_version').fetchone()[0]
+for version, migration in enumerate(SCHEMA_MIGRATIONS[user_version:], user_version + 1):
+    connection.execute(migration)
+    connection.execute(f'PRAGMA user_version={version}')
+connection.commit()
+del(user_version)
+
+#function: store the messages of a received frame
+# accepts: list of messages, rssi, snr, sender (None for a legacy frame),
+#          spreading factor, EUI-64 of the LoStik and frequency (Hz)
+def insert_inbound_messages(messages,rssi,snr,sender,sf,radio=None,frequency=None):
     time_received = int(round(time()*1000))
-    db = sqlite3.connect('piers.db')
-    db.execute('''
+    connection.executemany('''
         INSERT INTO messages (
             message,
             time_received,
             rssi,
-            snr)
-        VALUES (?, ?, ?, ?)''',
-        (message, time_received, rssi, snr))
-    db.commit()
-    db.close()
-
-def insert_outbound_message(message):
-    db = sqlite3.connect('piers.db')
-    db.execute('INSERT INTO messages (message) VALUES (?)', (message,))
-    db.commit()
-    db.close()
-
-def get_next_outbound_message():
-    db = sqlite3.connect('piers.db')
-    c = db.cursor()       
-    c.execute('''
+            snr,
+            sender,
+            sf,
+            radio,
+            frequency)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+        [(message, time_received, rssi, snr, sender, sf, radio, frequency) for message in messages])
+    connection.commit()
+    notify.notify('history')
+
+#function: queue a message for transmission
+# accepts: message and priority
+def insert_outbound_message(message, priority=PRIORITY_NORMAL):
+    time_queued = int(round(time()*1000))
+    connection.execute('INSERT INTO messages (message, time_queued, priority) VALUES (?, ?, ?)',
+                       (message, time_queued, priority))
+    connection.commit()
+    notify.notify('queue')
+
+#function: queue many messages for transmission in a single transaction
+# accepts: list of (message, priority)
+#    note: one commit and one notification for the lot, rather than one per
+#          message as with insert_outbound_message
+def insert_outbound_messages(messages):
+    time_queued = int(round(time()*1000))
+    connection.executemany('INSERT INTO messages (message, time_queued, priority) VALUES (?, ?, ?)',
+                           [(message, time_queued, priority) for message, priority in messages])
+    connection.commit()
+    notify.notify('queue')
+
+#function: atomically take the next queued messages and mark them in flight
+# accepts: fits, a function returning True if a list of messages (rowid,
+#          message, time_queued, priority) can be sent together, aging (ms a message must wait to be raised one priority
+#          level, None for strict priority) and the maximum number of
+#          messages to consider and the EUI-64 of the LoStik dequeuing
+#          (None if there is only one)
+# returns: list of (rowid, message, time_queued, priority) in the order to
+#          send (empty if nothing fits)
+#    note: messages are taken highest priority first, FIFO within a priority,
+#          the first message that does not fit ends the list.  Aging keeps
+#          low priority messages from being starved by a steady stream of
+#          higher priority ones.  A long message part way through its
+#          fragments is left for the LoStik that sent its first fragments,
+#          its receivers could not reassemble it otherwise.
+def dequeue_outbound_messages(fits, aging=None, limit=16, radio=None):
+    time_dequeued = int(round(time()*1000))
+    connection.execute('BEGIN IMMEDIATE')
+    records = connection.execute('''
         SELECT
             rowid,
             message,
-            time_sent,
-            time_received
+            time_queued,
+            COALESCE(priority, 1)
         FROM
             messages
         WHERE
-            time_sent IS NULL AND time_received IS NULL
-        ''')
-    record = c.fetchone()
-    c.close()
-    db.close()
-    if record:
-        return record[0], record[1]
-    else:
-        return None, None
+            time_sent IS NULL AND time_received IS NULL AND time_dequeued IS NULL
+            AND (? IS NULL OR fragments_sent IS NULL OR radio=?)
+        ORDER BY
+            COALESCE(priority, 1) + COALESCE((? - COALESCE(time_queued, ?)) / ?, 0) DESC,
+            rowid
+        LIMIT ?''',
+        (radio, radio, time_dequeued, time_dequeued, aging, limit)).fetchall()
+    dequeued = []
+    for record in records:
+        if not fits(dequeued + [record]):
+            break
+        dequeued.append(record)
+    connection.executemany('UPDATE messages SET time_dequeued=? WHERE rowid=?',
+                           [(time_dequeued, rowid) for rowid, message, time_queued, priority in dequeued])
+    connection.commit()
+    return dequeued
+
+#function: return messages left in flight by an interrupted service to the queue
+#    note: a message in flight may or may not have reached the air, requeue
+#          so that it is resent rather than silently lost
+def requeue_in_flight_messages():
+    connection.execute('''
+        UPDATE
+            messages
+        SET
+            time_dequeued=NULL
+        WHERE
+            time_sent IS NULL AND time_received IS NULL AND time_dequeued IS NOT NULL''')
+    connection.commit()
 
-def update_sent_outbound_message(rowid,time_sent,air_time):
-    db = sqlite3.connect('piers.db')
-    c = db.cursor()
-    c.execute('''
+#function: record the transmission of outbound messages
+# accepts: list of (rowid, time_sent, air_time), spreading factor, sequence
+#          number of the frame (None without reliable delivery), EUI-64 of
+#          the LoStik and frequency (Hz)
+def update_sent_outbound_messages(sent,sf,sequence=None,radio=None,frequency=None):
+    connection.executemany('''
         UPDATE
             messages
         SET
             time_sent=?,
-            air_time=?
+            air_time=?,
+            sf=?,
+            sequence=?,
+            radio=?,
+            frequency=?
+        WHERE
+            rowid=?''',
+        [(time_sent, air_time, sf, sequence, radio, frequency, rowid) for rowid, time_sent, air_time in sent])
+    connection.commit()
+    notify.notify('history')
+
+#function: obtain the progress of a long outbound message
+# accepts: rowid
+# returns: number of fragments sent so far and their air time
+def fragment_progress(rowid):
+    return connection.execute('''
+        SELECT
+            COALESCE(fragments_sent, 0),
+            COALESCE(air_time, 0)
+        FROM
+            messages
         WHERE
             rowid=?''',
-        (time_sent,air_time,rowid))
-    db.commit()
-    c.close()
-    db.close()
+        (rowid,)).fetchone()
+
+#function: record the fragments of a long outbound message sent so far and
+#          return it to the queue for the rest to be sent
+# accepts: rowid, number of fragments, air time of the fragments just sent and
+#          EUI-64 of the LoStik that sent them
+#    note: air time accumulates until the last fragment is sent
+def update_fragments_sent(rowid, fragments_sent, air_time, radio=None):
+    connection.execute('''
+        UPDATE
+            messages
+        SET
+            fragments_sent=?,
+            air_time=COALESCE(air_time, 0)+?,
+            radio=?,
+            time_dequeued=NULL
+        WHERE
+            rowid=?''',
+        (fragments_sent, air_time, radio, rowid))
+    connection.commit()
+
+#function: record that every peer acknowledged outbound messages
+# accepts: list of rowids
+def update_acknowledged_outbound_messages(rowids):
+    time_acked = int(round(time()*1000))
+    connection.executemany('UPDATE messages SET time_acked=? WHERE rowid=?',
+                           [(time_acked, rowid) for rowid in rowids])
+    connection.commit()
+    notify.notify('history')
+
+#function: obtain the sequence number of the last frame sent with reliable delivery
+# returns: sequence number or None
+def last_sequence():
+    record = connection.execute('''
+        SELECT
+            sequence
+        FROM
+            messages
+        WHERE
+            sequence IS NOT NULL
+        ORDER BY
+            rowid DESC
+        LIMIT 1''').fetchone()
+    return None if record == None else record[0]
+
+#function: obtain the link quality of recently received frames
+# accepts: maximum number of frames and EUI-64 of the LoStik that received
+#          them (None for any)
+# returns: list of (sender, snr, time_received), oldest first
+def recent_link_quality(limit, radio=None):
+    records = connection.execute('''
+        SELECT
+            sender,
+            snr,
+            time_received
+        FROM
+            messages
+        WHERE
+            sender IS NOT NULL AND time_received IS NOT NULL AND (? IS NULL OR radio=?)
+        ORDER BY
+            rowid DESC
+        LIMIT ?''',
+        (radio, radio, limit)).fetchall()
+    return list(reversed(records))
+
+#function: obtain the oldest message still waiting to be sent
+# returns: rowid or None if the outbound queue is empty
+#    note: the index must be named, the planner will not pick a partial
+#          index for min(rowid) and would otherwise scan the whole table
+def first_queued_rowid():
+    return connection.execute('''
+        SELECT
+            min(rowid)
+        FROM
+            messages INDEXED BY outbound_queue
+        WHERE
+            time_sent IS NULL AND time_received IS NULL''').fetchone()[0]
+
+#columns of the history queries, also read from the archives
+HISTORY_COLUMNS = ['rowid', 'message', 'time_sent', 'air_time', 'time_received',
+                   'rssi', 'snr', 'sequence', 'time_acked']
+
+#function: obtain a page of sent and received messages older than a rowid
+# accepts: rowid and maximum number of messages
+# returns: list of (rowid, message, time_sent, air_time, time_received,
+#          rssi, snr, sequence, time_acked), oldest first
+#    note: continues into the archives, see archive.py, which are only read
+#          in full when piers.db does not fill the page
+def history_before(rowid, limit):
+    records = connection.execute('''
+        SELECT
+            rowid,
+            message,
+            time_sent,
+            air_time,
+            time_received,
+            rssi,
+            snr,
+            sequence,
+            time_acked
+        FROM
+            messages
+        WHERE
+            rowid<? AND (time_sent IS NOT NULL OR time_received IS NOT NULL)
+        ORDER BY
+            rowid DESC
+        LIMIT ?''',
+        (rowid, limit)).fetchall()
+    if len(records) < limit:
+        records += archive.history_before(rowid, limit, HISTORY_COLUMNS)
+    else:
+        #the page is full, only messages archived out of rowid order can
+        #belong on it
+        records += archive.history_before(rowid, limit, HISTORY_COLUMNS, records[-1][0])
+    return sorted(records, key=lambda record: record[0])[-limit:]
+
+#function: obtain messages newer than a rowid
+# accepts: rowid
+# returns: cursor over (rowid, message, time_sent, air_time, time_received,
+#          rssi, snr, sequence, time_acked), oldest first
+#    note: includes queued messages, read with fetchmany() so that only as
+#          many rows as needed are stepped through
+def history_after(rowid):
+    return connection.execute('''
+        SELECT
+            rowid,
+            message,
+            time_sent,
+            air_time,
+            time_received,
+            rssi,
+            snr,
+            sequence,
+            time_acked
+        FROM
+            messages
+        WHERE
+            rowid>?
+        ORDER BY
+            rowid''',
+        (rowid,))
+
+#function: obtain a page of messages newer than a rowid
+# accepts: rowid and maximum number of messages
+# returns: list of records (see history_after), oldest first
+#    note: includes queued messages and continues from the archives into
+#          piers.db, see archive.py
+def history_page_after(rowid, limit):
+    cursor = history_after(rowid)
+    records = cursor.fetchmany(limit)
+    cursor.close()
+    records += archive.history_after(rowid, limit, HISTORY_COLUMNS)
+    return sorted(records, key=lambda record: record[0])[:limit]
+
+#function: obtain how long sent messages waited in the outbound queue
+# accepts: earliest time sent (ms) to include
+# returns: list of (priority, wait in ms), shortest wait first
+def queue_wait_times(since):
+    return connection.execute('''
+        SELECT
+            COALESCE(priority, 1),
+            time_sent - time_queued
+        FROM
+            messages
+        WHERE
+            time_sent>=? AND time_queued IS NOT NULL
+        ORDER BY
+            2''',
+        (since,)).fetchall()
+
+#function: obtain the frames transmitted since a point in time
+# accepts: earliest time sent (ms) to include and EUI-64 of the LoStik that
+#          sent them (None for any)
+# returns: list of (time_sent, air_time), oldest first
+#    note: messages sent in the same frame share time_sent, their air time
+#          is summed back into that of the frame
+def transmissions_since(since, radio=None):
+    return connection.execute('''
+        SELECT
+            time_sent,
+            sum(air_time)
+        FROM
+            messages
+        WHERE
+            time_sent>=? AND air_time IS NOT NULL AND (? IS NULL OR radio=?)
+        GROUP BY
+            time_sent
+        ORDER BY
+            time_sent''',
+        (since, radio, radio)).fetchall()
+
+#function: count the messages waiting to be sent
+# returns: queue depth (including messages in flight)
+def queue_depth():
+    return connection.execute('''
+        SELECT
+            count(*)
+        FROM
+            messages INDEXED BY outbound_queue
+        WHERE
+            time_sent IS NULL AND time_received IS NULL''').fetchone()[0]
+
+#function: obtain the database change counter
+# returns: integer that changes whenever another connection commits
+def data_version():
+    return connection.execute('PRAGMA data_version').fetchone()[0]
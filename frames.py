@@ -0,0 +1,280 @@
+########################################################################
+#                                                                      #
+#          NAME:  PiERS Chat - Frame Functions                         #
+#  DEVELOPED BY:  Chris Clement (K7CTC)                                #
+#       VERSION:  v2.0 (beta)                                          #
+#                                                                      #
+########################################################################
+
+########################################################################
+# Frame Notes:  Several queued messages are sent in a single LoRa      #
+#               packet so that the fixed preamble and header cost is   #
+#               paid once per TX window rather than once per message.  #
+#                                                                      #
+#               byte 0     frame type                                  #
+#               byte 1     sender (time slot of the transmitting node) #
+#               byte 2..   records, each a one byte length followed    #
+#                          by the encoded message                      #
+#                                                                      #
+#               The frame type doubles as the encoding version:        #
+#                                                                      #
+#               0x01  ASCII, length is the number of bytes             #
+#               0x02  6-bit packed, length is the number of symbols    #
+#                                                                      #
+#               Packed records use one 6-bit symbol for space, a-z,    #
+#               A-Z and 0-9, and an escape symbol followed by a        #
+#               second symbol for the rarer . ? and ! characters.      #
+#               Text heavy in punctuation packs to more bytes than     #
+#               ASCII, so a frame is only sent packed when it is no    #
+#               longer than in ASCII and a message never costs more    #
+#               air time than its ASCII form.                          #
+#                                                                      #
+#               A beacon frame (0x03) carries a single byte after the  #
+#               sender, the spreading factor the sender will use for   #
+#               its data frames (see adr.py).                          #
+#                                                                      #
+#               A time sync frame (0x04) carries six bytes after the   #
+#               sender, the sender's clock in milliseconds since the   #
+#               Unix epoch when the frame was handed to the LoStik     #
+#               (see timesync.py).                                     #
+#                                                                      #
+#               A demand frame (0x05) carries a single byte after the  #
+#               sender, the sender's queue depth (see dama.py).        #
+#                                                                      #
+#               A message longer than FRAGMENT_LENGTH is sent in       #
+#               fragment frames (0x07 ASCII, 0x08 6-bit packed), one   #
+#               fragment per frame:                                    #
+#                                                                      #
+#               byte 2     message id                                  #
+#               byte 3     fragment index                              #
+#               byte 4     fragment count                              #
+#               byte 5..   a single record holding the fragment        #
+#                                                                      #
+#               With reliable delivery the data or fragment frame type #
+#               has 0x10 set (0x11, 0x12, 0x17, 0x18) and a one byte   #
+#               sequence number follows the sender.  An ACK frame      #
+#               (0x06) carries 4 bytes per acknowledged peer after the #
+#               sender: the peer, the highest sequence number heard    #
+#               from it and a 16-bit bitmap of that and the 15 before  #
+#               it, bit 0 for the highest (see reliability.py).        #
+#                                                                      #
+#               Frame types are below 0x20 so that a legacy frame      #
+#               (plain ASCII message, first byte printable) can still  #
+#               be told apart and received.                            #
+########################################################################
+
+if __name__ == '__main__':
+    print('ERROR: frames.py is not intended for direct execution!')
+
+FRAME_DATA_ASCII = 0x01
+FRAME_DATA_PACKED = 0x02
+FRAME_BEACON = 0x03
+FRAME_TIME_SYNC = 0x04
+FRAME_DEMAND = 0x05
+FRAME_ACK = 0x06
+FRAME_FRAGMENT_ASCII = 0x07
+FRAME_FRAGMENT_PACKED = 0x08
+FRAME_SEQUENCED = 0x10
+
+PACKED_SYMBOLS = ' abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+PACKED_ESCAPE = 63
+PACKED_ESCAPED_SYMBOLS = '.?!'
+
+#function: encode a message as 6-bit symbols
+# accepts: message
+# returns: symbol count and packed bytes
+#    note: raises ValueError for a character outside of the chat alphabet
+def pack_symbols(message):
+    symbols = []
+    for character in message:
+        if character in PACKED_SYMBOLS:
+            symbols.append(PACKED_SYMBOLS.index(character))
+        elif character in PACKED_ESCAPED_SYMBOLS:
+            symbols.append(PACKED_ESCAPE)
+            symbols.append(PACKED_ESCAPED_SYMBOLS.index(character))
+        else:
+            raise ValueError(f'unable to pack {character!r}')
+    bits = 0
+    for symbol in symbols:
+        bits = (bits << 6) | symbol
+    padding = -6 * len(symbols) % 8
+    packed = (bits << padding).to_bytes((6 * len(symbols) + padding) // 8, 'big')
+    return len(symbols), packed
+
+#function: decode 6-bit symbols
+# accepts: symbol count and packed bytes
+# returns: message
+def unpack_symbols(symbol_count, packed):
+    padding = -6 * symbol_count % 8
+    bits = int.from_bytes(packed, 'big') >> padding
+    symbols = [(bits >> (6 * i)) & 0x3F for i in reversed(range(symbol_count))]
+    message = ''
+    escaped = False
+    for symbol in symbols:
+        if escaped:
+            if symbol >= len(PACKED_ESCAPED_SYMBOLS):
+                raise ValueError('invalid escaped symbol')
+            message += PACKED_ESCAPED_SYMBOLS[symbol]
+            escaped = False
+        elif symbol == PACKED_ESCAPE:
+            escaped = True
+        else:
+            message += PACKED_SYMBOLS[symbol]
+    return message
+
+#function: choose the encoding of a data or fragment frame
+# accepts: list of messages and frame type asked for
+# returns: FRAME_DATA_PACKED if asked for and no longer than ASCII, otherwise
+#          FRAME_DATA_ASCII
+def frame_encoding(messages, frame_type):
+    if frame_type != FRAME_DATA_PACKED:
+        return frame_type
+    packed_length = sum(len(encode_record(message, FRAME_DATA_PACKED)) for message in messages)
+    if packed_length > sum(1 + len(message) for message in messages):
+        return FRAME_DATA_ASCII
+    return FRAME_DATA_PACKED
+
+#function: encode a single record of a data frame
+# accepts: message and frame type
+# returns: record (bytes)
+def encode_record(message, frame_type):
+    if frame_type == FRAME_DATA_PACKED:
+        symbol_count, packed = pack_symbols(message)
+        return bytes([symbol_count]) + packed
+    record = message.encode('ASCII')
+    return bytes([len(record)]) + record
+
+#function: build a data frame
+# accepts: sender, list of messages, frame type and sequence number (None for
+#          a frame without one)
+# returns: payload (bytes)
+#    note: a packed frame longer than in ASCII is sent in ASCII
+def pack_data_frame(sender, messages, frame_type=FRAME_DATA_PACKED, sequence=None):
+    frame_type = frame_encoding(messages, frame_type)
+    if sequence == None:
+        payload = bytearray([frame_type, sender])
+    else:
+        payload = bytearray([frame_type | FRAME_SEQUENCED, sender, sequence])
+    for message in messages:
+        payload += encode_record(message, frame_type)
+    return bytes(payload)
+
+#function: obtain the length of each record of a data frame
+# accepts: list of messages and frame type
+# returns: list of record lengths (bytes)
+def record_lengths(messages, frame_type=FRAME_DATA_PACKED):
+    frame_type = frame_encoding(messages, frame_type)
+    return [len(encode_record(message, frame_type)) for message in messages]
+
+#function: build a fragment frame
+# accepts: sender, message id, fragment index, fragment count, fragment, data
+#          frame type giving the encoding and sequence number (None for a
+#          frame without one)
+# returns: payload (bytes)
+#    note: a packed fragment longer than in ASCII is sent in ASCII
+def pack_fragment(sender, message_id, index, count, fragment, frame_type=FRAME_DATA_PACKED, sequence=None):
+    frame_type = frame_encoding([fragment], frame_type)
+    fragment_type = FRAME_FRAGMENT_PACKED if frame_type == FRAME_DATA_PACKED else FRAME_FRAGMENT_ASCII
+    if sequence == None:
+        payload = bytearray([fragment_type, sender])
+    else:
+        payload = bytearray([fragment_type | FRAME_SEQUENCED, sender, sequence])
+    payload += bytes([message_id, index, count]) + encode_record(fragment, frame_type)
+    return bytes(payload)
+
+#function: build a beacon frame
+# accepts: sender and spreading factor
+# returns: payload (bytes)
+def pack_beacon(sender, sf):
+    return bytes([FRAME_BEACON, sender, sf])
+
+#function: build a time sync frame
+# accepts: sender and time (ms since the Unix epoch)
+# returns: payload (bytes)
+def pack_time_sync(sender, timestamp):
+    return bytes([FRAME_TIME_SYNC, sender]) + timestamp.to_bytes(6, 'big')
+
+#function: build a demand frame
+# accepts: sender and queue depth (0 to 255)
+# returns: payload (bytes)
+def pack_demand(sender, depth):
+    return bytes([FRAME_DEMAND, sender, depth])
+
+#function: build an ACK frame
+# accepts: sender and list of (peer, highest sequence number, bitmap)
+# returns: payload (bytes)
+def pack_ack(sender, entries):
+    payload = bytearray([FRAME_ACK, sender])
+    for peer, last, bitmap in entries:
+        payload += bytes([peer, last]) + bitmap.to_bytes(2, 'big')
+    return bytes(payload)
+
+#function: split a received frame into its contents
+# accepts: payload (bytes)
+# returns: frame type, sender (None for a legacy frame) and contents, a list
+#          of messages for a data frame, the spreading factor for a beacon
+#          the sender's time for a time sync frame, the queue depth for a
+#          demand frame, a list of (peer, highest sequence number, bitmap)
+#          for an ACK frame, (message id, fragment index, fragment count,
+#          fragment) for a fragment frame or (sequence number, contents) for
+#          a sequenced data or fragment frame
+#    note: a legacy frame is returned as an ASCII data frame, raises
+#          ValueError on a malformed frame
+def unpack_frame(payload):
+    if len(payload) == 0:
+        raise ValueError('empty frame')
+    if payload[0] >= 0x20:
+        return FRAME_DATA_ASCII, None, [payload.decode('ASCII')]
+    frame_type = payload[0]
+    if (frame_type & FRAME_SEQUENCED and frame_type & ~FRAME_SEQUENCED in
+            (FRAME_DATA_ASCII, FRAME_DATA_PACKED, FRAME_FRAGMENT_ASCII, FRAME_FRAGMENT_PACKED)):
+        if len(payload) < 3:
+            raise ValueError('malformed sequenced frame')
+        sender, contents = unpack_frame(bytes([frame_type & ~FRAME_SEQUENCED, payload[1]]) + payload[3:])[1:]
+        return frame_type, sender, (payload[2], contents)
+    if frame_type in (FRAME_FRAGMENT_ASCII, FRAME_FRAGMENT_PACKED):
+        if len(payload) < 6 or not payload[3] < payload[4]:
+            raise ValueError('malformed fragment')
+        data_frame_type = FRAME_DATA_PACKED if frame_type == FRAME_FRAGMENT_PACKED else FRAME_DATA_ASCII
+        sender, messages = unpack_frame(bytes([data_frame_type, payload[1]]) + payload[5:])[1:]
+        if len(messages) != 1:
+            raise ValueError('malformed fragment')
+        return frame_type, sender, (payload[2], payload[3], payload[4], messages[0])
+    if frame_type not in (FRAME_DATA_ASCII, FRAME_DATA_PACKED, FRAME_BEACON, FRAME_TIME_SYNC, FRAME_DEMAND, FRAME_ACK) or len(payload) < 2:
+        raise ValueError(f'unknown frame type {frame_type}')
+    sender = payload[1]
+    if frame_type == FRAME_BEACON:
+        if len(payload) < 3 or not 7 <= payload[2] <= 12:
+            raise ValueError('malformed beacon')
+        return frame_type, sender, payload[2]
+    if frame_type == FRAME_TIME_SYNC:
+        if len(payload) != 8:
+            raise ValueError('malformed time sync')
+        return frame_type, sender, int.from_bytes(payload[2:], 'big')
+    if frame_type == FRAME_DEMAND:
+        if len(payload) != 3:
+            raise ValueError('malformed demand')
+        return frame_type, sender, payload[2]
+    if frame_type == FRAME_ACK:
+        if len(payload) < 6 or (len(payload) - 2) % 4 != 0:
+            raise ValueError('malformed ack')
+        return frame_type, sender, [(payload[position], payload[position + 1],
+                                     int.from_bytes(payload[position + 2:position + 4], 'big'))
+                                    for position in range(2, len(payload), 4)]
+    messages = []
+    position = 2
+    while position < len(payload):
+        length = payload[position]
+        if frame_type == FRAME_DATA_PACKED:
+            record_length = (6 * length + 7) // 8
+        else:
+            record_length = length
+        record = payload[position + 1:position + 1 + record_length]
+        if len(record) != record_length:
+            raise ValueError('truncated record')
+        if frame_type == FRAME_DATA_PACKED:
+            messages.append(unpack_symbols(length, record))
+        else:
+            messages.append(record.decode('ASCII'))
+        position += 1 + record_length
+    return frame_type, sender, messages
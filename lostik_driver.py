@@ -0,0 +1,211 @@
+########################################################################
+#                                                                      #
+#          NAME:  PiERS Chat - LoStik Driver                           #
+#  DEVELOPED BY:  Chris Clement (K7CTC)                                #
+#       VERSION:  v2.0 (beta)                                          #
+#                                                                      #
+########################################################################
+
+########################################################################
+# Driver Notes:  The RN2903 answers every command with exactly one     #
+#                line, in order, so commands can be written back to    #
+#                back without waiting and each response matched to its #
+#                command by position.  Lines that are not responses    #
+#                (radio_rx, radio_err and the radio_tx_ok that         #
+#                completes a transmission) are routed separately.      #
+#                pySerial does not support asyncio, so a reader thread #
+#                splits the incoming byte stream into lines and hands  #
+#                them to the event loop, noting when each radio_rx     #
+#                line was read for time synchronization.               #
+#                                                                      #
+#                LED modes:  sync      wait for each LED command       #
+#                            deferred  write LED commands behind the   #
+#                                      radio command, never wait       #
+#                            off       no LED signalling               #
+########################################################################
+
+#import from required 3rd party libraries
+import serial
+
+#import from project library
+from serial_trace import TRACE_COMMAND, TRACE_RESPONSE, TRACE_TX, TRACE_RX
+import metrics
+
+#import from standard library
+from collections import deque
+import asyncio
+import threading
+import time
+
+if __name__ == '__main__':
+    print('ERROR: lostik_driver.py is not intended for direct execution!')
+
+LED_PINS = {'blue': b'GPIO10', 'red': b'GPIO11'}
+
+#function: name a command for metrics, dropping its argument
+# accepts: command (bytes)
+# returns: name (for example 'radio get snr', 'radio set sf' or 'radio tx')
+def command_name(command):
+    words = command.split(b' ')
+    if len(words) > 2 and words[1] in (b'get', b'set'):
+        return b' '.join(words[:3]).decode('ASCII')
+    return b' '.join(words[:2]).decode('ASCII')
+
+#function: decode a line read from the LoStik
+# accepts: line (bytes)
+# returns: line (string)
+#    note: bytes outside ASCII (line noise) are replaced and counted rather
+#          than dropping the line, which would pair the responses that follow
+#          with the wrong commands
+def decode_line(line):
+    try:
+        return line.decode('ASCII')
+    except UnicodeDecodeError:
+        metrics.increment('piers_serial_noise_total')
+        return line.decode('ASCII', errors='replace')
+
+class LoStikDriver:
+    #accepts: serial port, LED mode ('sync', 'deferred' or 'off') and
+    #         optionally a TraceWriter recording every line exchanged
+    #   note: raises serial.SerialException if the port cannot be opened
+    def __init__(self, port, led_mode='deferred', trace=None):
+        self.port = port
+        self.led_mode = led_mode
+        self.trace = trace
+        self.serial = serial.Serial(port, baudrate=57600, timeout=1)
+        self.loop = None
+        self.reader_thread = None
+        self.reader_stop = threading.Event()
+        self.pending = deque()   #(response future (None = discard), command name, time
+                                 #written) in command order
+        self.tx_result = None    #future for the completion of a transmission
+        self.rx_lines = None     #(line, time.monotonic() when read) of radio_rx and
+                                 #radio_err lines
+
+    #function: send a command and wait for the response without the event loop
+    # accepts: command (bytes, without line terminator)
+    # returns: response
+    #    note: for use before start() only
+    def command_blocking(self, command):
+        if self.trace != None:
+            self.trace.record(TRACE_COMMAND, time.monotonic(), command)
+        self.serial.write(command + b'\r\n')
+        response = decode_line(self.serial.readline()).rstrip()
+        if self.trace != None:
+            self.trace.record(TRACE_RESPONSE, time.monotonic(), response)
+        return response
+
+    #function: start the reader thread, call from within the event loop
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.rx_lines = asyncio.Queue()
+        self.reader_thread = threading.Thread(target=self.reader, daemon=True)
+        self.reader_thread.start()
+
+    #function: stop the reader thread and close the serial port
+    def close(self):
+        if self.reader_thread != None:
+            self.reader_stop.set()
+            self.serial.cancel_read()
+            self.reader_thread.join()
+        self.serial.close()
+
+    #function: split the incoming byte stream into lines (reader thread)
+    def reader(self):
+        buffer = b''
+        while not self.reader_stop.is_set():
+            try:
+                buffer += self.serial.read(self.serial.in_waiting or 1)
+            except serial.SerialException:
+                break
+            time_read = time.monotonic()
+            while b'\r\n' in buffer:
+                line, buffer = buffer.split(b'\r\n', 1)
+                if not self.reader_stop.is_set():
+                    self.loop.call_soon_threadsafe(self.dispatch, line, time_read)
+
+    #function: route a line to its command, transmission or the rx queue
+    # accepts: line (bytes) and time.monotonic() when it was read
+    def dispatch(self, line, time_read):
+        line = decode_line(line)
+        if self.tx_result != None and line in ('radio_tx_ok', 'radio_err'):
+            if self.trace != None:
+                self.trace.record(TRACE_TX, time_read, line)
+            if line == 'radio_err':
+                metrics.increment('piers_radio_errors_total', 'context="tx"')
+            if not self.tx_result.done():
+                self.tx_result.set_result(line)
+            self.tx_result = None
+        elif line.startswith('radio_rx') or line == 'radio_err':
+            if self.trace != None:
+                self.trace.record(TRACE_RX, time_read, line)
+            if line == 'radio_err':
+                metrics.increment('piers_radio_errors_total', 'context="rx"')
+            self.rx_lines.put_nowait((line, time_read))
+        elif self.pending:
+            if self.trace != None:
+                self.trace.record(TRACE_RESPONSE, time_read, line)
+            future, name, time_written = self.pending.popleft()
+            metrics.observe('piers_serial_round_trip_milliseconds',
+                            (time.perf_counter() - time_written) * 1000, f'command="{name}"')
+            if future != None and not future.done():
+                future.set_result(line)
+
+    #function: write commands back to back
+    # accepts: commands (bytes, without line terminator) and whether to wait
+    # returns: list of futures (None when not waiting)
+    def write(self, commands, wait=True):
+        futures = []
+        time_written = time.perf_counter()
+        for command in commands:
+            future = self.loop.create_future() if wait else None
+            self.pending.append((future, command_name(command), time_written))
+            futures.append(future)
+            if self.trace != None:
+                self.trace.record(TRACE_COMMAND, time.monotonic(), command)
+        self.serial.write(b''.join(command + b'\r\n' for command in commands))
+        return futures
+
+    #function: send a command and await the response
+    # accepts: command (bytes, without line terminator)
+    # returns: response
+    async def command(self, command):
+        return await self.write([command])[0]
+
+    #function: send several commands in a single write and await all responses
+    # accepts: commands (bytes, without line terminator)
+    # returns: list of responses
+    async def commands(self, *commands):
+        return list(await asyncio.gather(*self.write(commands)))
+
+    #function: start a transmission
+    # accepts: payload (bytes)
+    # returns: response to radio tx ('ok' once the transmission has started)
+    #    note: await transmission() for radio_tx_ok or radio_err
+    async def transmit(self, payload):
+        self.tx_result = self.loop.create_future()
+        response = await self.command(b'radio tx ' + payload.hex().encode('ASCII'))
+        if response != 'ok':
+            self.tx_result = None
+        return response
+
+    #function: await the completion of a transmission
+    # returns: radio_tx_ok or radio_err
+    async def transmission(self):
+        return await self.tx_result
+
+    #function: await the next radio_rx or radio_err line
+    # returns: line and time.monotonic() when it was read
+    async def rx_line(self):
+        return await self.rx_lines.get()
+
+    #function: control an LED according to the LED mode
+    # accepts: LED ('blue' or 'red') and boolean
+    async def led(self, led, state):
+        if self.led_mode == 'off':
+            return
+        command = b'sys set pindig ' + LED_PINS[led] + (b' 1' if state else b' 0')
+        if self.led_mode == 'deferred':
+            self.write([command], wait=False)
+        else:
+            await self.command(command)
@@ -0,0 +1,298 @@
+########################################################################
+#                                                                      #
+#          NAME:  PiERS Chat - LoStik Emulator                         #
+#  DEVELOPED BY:  Chris Clement (K7CTC)                                #
+#       VERSION:  v2.0 (beta)                                          #
+#                                                                      #
+########################################################################
+
+########################################################################
+# Emulator Notes:  This module emulates the subset of the RN2903       #
+#                  command set used by lostik_service.py on a pseudo-  #
+#                  terminal (POSIX only).  Start the emulator, then    #
+#                  point the service at the printed port using the     #
+#                  --port argument.  Transmissions are acknowledged    #
+#                  with radio_tx_ok after the time-on-air computed     #
+#                  from lostik_settings, and inbound radio_rx frames   #
+#                  can be injected at a fixed rate to load test the    #
+#                  receive path without LoStik hardware.               #
+#                                                                      #
+#                  Several emulators can share the air (--air) so that #
+#                  a network of services can be run on one computer.   #
+#                  Each transmission is sent to the other emulators    #
+#                  over UDP on localhost and is received if the radio  #
+#                  stays in receive mode at the same spreading factor  #
+#                  for its whole time-on-air.  Frames that overlap at  #
+#                  a receiver are lost to collision.  A share of the   #
+#                  remaining frames can be dropped at random (--loss)  #
+#                  to exercise retransmission.                         #
+########################################################################
+
+#import from project library
+from airtime import time_on_air
+import frames
+import lostik_settings
+
+#import from standard library
+from sys import exit
+import argparse
+import os
+import random
+import socket
+import threading
+import time
+import tty
+
+#establish and parse command line arguments
+parser = argparse.ArgumentParser(description='PiERS Chat - LoStik Emulator',
+                                 epilog='Created by K7CTC.')
+parser.add_argument('--hweui',
+                    help='EUI-64 reported by the emulated LoStik (default: first registered EUI-64)',
+                    default=list(lostik_settings.TIME_SLOT.keys())[0])
+parser.add_argument('--rx-rate',
+                    type=float,
+                    help='inbound frames injected per minute (default: 0)',
+                    default=0)
+parser.add_argument('--rx-message',
+                    help='message text carried by injected frames (default: "Emulated message")',
+                    default='Emulated message')
+parser.add_argument('--rx-sender',
+                    type=int,
+                    help='send injected messages as data frames from this time slot (default: legacy frames)')
+parser.add_argument('--latency',
+                    type=float,
+                    help='serial latency in milliseconds added to each write received from the service (default: 0)',
+                    default=0)
+parser.add_argument('--rssi',
+                    type=int,
+                    help='rssi reported for injected frames (default: -60)',
+                    default=-60)
+parser.add_argument('--snr',
+                    type=int,
+                    help='snr reported for injected frames (default: 9)',
+                    default=9)
+parser.add_argument('--air',
+                    type=int,
+                    help='share the air with other emulators, listening on UDP port AIR plus my time slot')
+parser.add_argument('--loss',
+                    type=float,
+                    help='percentage of frames from the air dropped at random (default: 0)',
+                    default=0)
+args = parser.parse_args()
+
+#emulated radio state: 'idle', 'rx' or 'tx'
+radio_state = 'idle'
+radio_sf = int(lostik_settings.SET_SF.decode('ASCII').lstrip('sf'))
+radio_freq = 923300000  #hardware default
+state_lock = threading.Lock()
+write_lock = threading.Lock()
+last_rssi = args.rssi
+last_snr = args.snr
+stats = {'frames_injected': 0, 'frames_delivered': 0, 'frames_missed': 0, 'frames_collided': 0, 'frames_dropped': 0, 'tx_count': 0, 'tx_air_time': 0.0, 'tx_offsets': [], 'rx_turnarounds': []}
+last_rx_delivered = None
+
+#shared air: UDP socket, addresses of the other emulators and the frames
+#currently arriving
+air_socket = None
+air_peers = []
+receptions = []
+if args.air != None:
+    if args.hweui not in lostik_settings.TIME_SLOT:
+        print(f'ERROR: {args.hweui} is not registered in lostik_settings.TIME_SLOT!')
+        exit(1)
+    my_time_slot = lostik_settings.TIME_SLOT[args.hweui]
+    air_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    air_socket.bind(('127.0.0.1', args.air + my_time_slot))
+    air_peers = [('127.0.0.1', args.air + time_slot)
+                 for time_slot in range(1, lostik_settings.SLOT_COUNT + 1) if time_slot != my_time_slot]
+
+master, slave = os.openpty()
+tty.setraw(slave)
+
+#function: write a response line to the service
+# accepts: response string
+def respond(response):
+    with write_lock:
+        os.write(master, response.encode('ASCII') + b'\r\n')
+
+#function: complete a transmission once time-on-air has elapsed
+def tx_complete():
+    global radio_state
+    with state_lock:
+        radio_state = 'idle'
+    respond('radio_tx_ok')
+
+#function: handle a single command from the service
+# accepts: command string (without line terminator)
+def handle_command(command):
+    global radio_state, radio_sf, radio_freq, last_rx_delivered
+    words = command.split()
+    if command == 'sys get ver':
+        respond(lostik_settings.FIRMWARE_VERSION)
+    elif command == 'sys get hweui':
+        respond(args.hweui)
+    elif command == 'mac pause':
+        respond('4294967245')
+    elif words[:3] == ['radio', 'set', 'sf'] and len(words) == 4:
+        radio_sf = int(words[3].lstrip('sf'))
+        respond('ok')
+    elif words[:3] == ['radio', 'set', 'freq'] and len(words) == 4:
+        radio_freq = int(words[3])
+        respond('ok')
+    elif words[:2] == ['radio', 'set'] or words[:3] == ['sys', 'set', 'pindig']:
+        respond('ok')
+    elif command == 'radio get rssi':
+        respond(str(last_rssi))
+    elif command == 'radio get snr':
+        respond(str(last_snr))
+    elif command == 'radio rx 0':
+        with state_lock:
+            if radio_state != 'idle':
+                respond('busy')
+                return
+            radio_state = 'rx'
+            #time from delivering a frame until the radio is receiving again
+            if last_rx_delivered != None:
+                stats['rx_turnarounds'].append((time.monotonic() - last_rx_delivered) * 1000)
+                last_rx_delivered = None
+        respond('ok')
+    elif command == 'radio rxstop':
+        with state_lock:
+            if radio_state == 'rx':
+                radio_state = 'idle'
+        respond('ok')
+    elif words[:2] == ['radio', 'tx'] and len(words) == 3:
+        try:
+            payload = bytes.fromhex(words[2])
+        except ValueError:
+            respond('invalid_param')
+            return
+        with state_lock:
+            if radio_state != 'idle':
+                respond('busy')
+                return
+            radio_state = 'tx'
+        respond('ok')
+        #TDMA slots begin on whole seconds, record how late into the second
+        #the transmission started as a measure of slot entry jitter
+        stats['tx_offsets'].append((time.time() % 1) * 1000)
+        air_time = time_on_air(len(payload), sf=radio_sf)
+        for peer in air_peers:
+            air_socket.sendto(bytes([radio_sf]) + radio_freq.to_bytes(4, 'big') + payload, peer)
+        stats['tx_count'] += 1
+        stats['tx_air_time'] += air_time
+        timer = threading.Timer(air_time / 1000, tx_complete)
+        timer.daemon = True
+        timer.start()
+    else:
+        respond('invalid_param')
+
+#function: inject inbound frames at the configured rate
+#    note: frames arriving while the radio is not receiving are missed,
+#          matching the behavior of the RN2903 hardware
+def inject_frames():
+    global radio_state, last_rx_delivered
+    interval = 60 / args.rx_rate
+    if args.rx_sender == None:
+        payload_hex = args.rx_message.encode('ASCII').hex()
+    else:
+        payload_hex = frames.pack_data_frame(args.rx_sender, [args.rx_message], frames.FRAME_DATA_ASCII).hex()
+    next_frame = time.monotonic() + interval
+    while True:
+        time.sleep(max(next_frame - time.monotonic(), 0))
+        next_frame += interval
+        stats['frames_injected'] += 1
+        with state_lock:
+            if radio_state != 'rx':
+                stats['frames_missed'] += 1
+                continue
+            radio_state = 'idle'
+            last_rx_delivered = time.monotonic()
+        stats['frames_delivered'] += 1
+        respond(f'radio_rx  {payload_hex}')
+
+#function: receive frames transmitted by other emulators
+#    note: a frame is lost if the radio is not receiving at the frame's
+#          spreading factor when it begins or ends, or if it overlaps
+#          another frame, frames on other frequencies are not heard at all
+def receive_air():
+    while True:
+        try:
+            datagram = air_socket.recv(512)
+        except OSError:
+            return
+        sf, freq, payload = datagram[0], int.from_bytes(datagram[1:5], 'big'), datagram[5:]
+        if freq != radio_freq:
+            continue
+        reception = {'collided': False, 'missed': False}
+        with state_lock:
+            for other_reception in receptions:
+                other_reception['collided'] = True
+                reception['collided'] = True
+            if radio_state != 'rx' or radio_sf != sf:
+                reception['missed'] = True
+            receptions.append(reception)
+        timer = threading.Timer(time_on_air(len(payload), sf=sf) / 1000, end_reception, (reception, sf, payload))
+        timer.daemon = True
+        timer.start()
+
+#function: deliver a frame from another emulator once its time-on-air has elapsed
+# accepts: reception, spreading factor and payload
+def end_reception(reception, sf, payload):
+    global radio_state, last_rx_delivered
+    with state_lock:
+        receptions.remove(reception)
+        if reception['collided']:
+            stats['frames_collided'] += 1
+            return
+        if random.random() * 100 < args.loss:
+            stats['frames_dropped'] += 1
+            return
+        if reception['missed'] or radio_state != 'rx' or radio_sf != sf:
+            stats['frames_missed'] += 1
+            return
+        radio_state = 'idle'
+        last_rx_delivered = time.monotonic()
+    stats['frames_delivered'] += 1
+    respond(f'radio_rx  {payload.hex()}')
+
+print(f'Emulated LoStik ({args.hweui}) available at {os.ttyname(slave)}')
+print(f'Time-on-air for a 50 byte payload: {round(time_on_air(50))}ms')
+print('Press CTRL+C to quit.')
+
+if args.rx_rate > 0:
+    threading.Thread(target=inject_frames, daemon=True).start()
+if air_socket != None:
+    threading.Thread(target=receive_air, daemon=True).start()
+
+buffer = b''
+try:
+    while True:
+        buffer += os.read(master, 1024)
+        #commands written together arrive together and share one latency,
+        #as with the USB to serial bridge on the LoStik
+        time.sleep(args.latency / 1000)
+        while b'\r\n' in buffer:
+            line, buffer = buffer.split(b'\r\n', 1)
+            handle_command(line.decode('ASCII'))
+except (KeyboardInterrupt, OSError):
+    print()
+
+print(f'  Frames Injected: {stats["frames_injected"]}')
+print(f' Frames Delivered: {stats["frames_delivered"]}')
+print(f'    Frames Missed: {stats["frames_missed"]}')
+if air_socket != None:
+    print(f'  Frames Collided: {stats["frames_collided"]}')
+    print(f'   Frames Dropped: {stats["frames_dropped"]}')
+print(f'    Transmissions: {stats["tx_count"]}')
+print(f'   Total Air Time: {round(stats["tx_air_time"])}ms')
+if stats['tx_offsets']:
+    tx_offsets = sorted(stats['tx_offsets'])
+    print(f'  TX Start Offset: {round(tx_offsets[len(tx_offsets) // 2])}ms median, {round(tx_offsets[-1])}ms max')
+if stats['rx_turnarounds']:
+    rx_turnarounds = sorted(stats['rx_turnarounds'])
+    print(f'   RX Turnaround: {rx_turnarounds[len(rx_turnarounds) // 2]:.1f}ms median, {rx_turnarounds[-1]:.1f}ms max')
+os.close(master)
+os.close(slave)
+if air_socket != None:
+    air_socket.close()
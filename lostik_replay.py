@@ -0,0 +1,192 @@
+########################################################################
+#                                                                      #
+#          NAME:  PiERS Chat - LoStik Replay                           #
+#  DEVELOPED BY:  Chris Clement (K7CTC)                                #
+#       VERSION:  v2.0 (beta)                                          #
+#                                                                      #
+########################################################################
+
+########################################################################
+# Replay Notes:  This module plays a LoStik back from a trace recorded #
+#                with the LoStik Service --trace argument, on a        #
+#                pseudo-terminal (POSIX only) in the same way as       #
+#                lostik_emulator.py.  Each command is answered with    #
+#                the response recorded for the same command, in the    #
+#                order recorded, and transmissions complete after the  #
+#                recorded time.  Received frames are delivered at the  #
+#                time they were recorded, counted from the first radio #
+#                rx command, and are missed unless the radio is        #
+#                receiving just as with the hardware.  The service     #
+#                therefore faces the same device and the same inbound  #
+#                workload on every run, so loop latency and throughput #
+#                can be compared across versions.  --speed compresses  #
+#                time: frames arrive and transmissions complete that   #
+#                many times faster, while the TDMA clock of the        #
+#                service runs as usual, so the workload offered is     #
+#                denser.  A command the trace holds no more responses  #
+#                for is answered with its last recorded response, or   #
+#                with ok.                                              #
+########################################################################
+
+#import from project library
+from airtime import time_on_air
+from lostik_driver import command_name
+from serial_trace import read_trace, TRACE_COMMAND, TRACE_RESPONSE, TRACE_TX, TRACE_RX
+
+#import from standard library
+from collections import deque
+from sys import exit
+import argparse
+import os
+import threading
+import time
+import tty
+
+#establish and parse command line arguments
+parser = argparse.ArgumentParser(description='PiERS Chat - LoStik Replay',
+                                 epilog='Created by K7CTC.')
+parser.add_argument('trace',
+                    help='trace file recorded with the LoStik Service --trace argument')
+parser.add_argument('--speed',
+                    type=float,
+                    help='replay this many times faster than recorded (default: 1)',
+                    default=1)
+args = parser.parse_args()
+if args.speed <= 0:
+    print('ERROR: --speed must be positive!')
+    exit(1)
+
+try:
+    records = read_trace(args.trace)
+except (OSError, ValueError) as error:
+    print(f'ERROR: Unable to read trace: {error}')
+    exit(1)
+
+#recorded responses by command name, transmissions and received frames
+responses = {}
+tx_completions = deque()  #(duration in seconds, radio_tx_ok or radio_err)
+rx_frames = []            #(seconds since the first radio rx command, line)
+unanswered = deque()
+tx_started = None
+rx_origin = None
+for kind, t, line in records:
+    if kind == TRACE_COMMAND:
+        unanswered.append(command_name(line.encode('ASCII')))
+        if rx_origin == None and unanswered[-1] == 'radio rx':
+            rx_origin = t
+    elif kind == TRACE_RESPONSE and unanswered:
+        name = unanswered.popleft()
+        responses.setdefault(name, deque()).append(line)
+        if name == 'radio tx' and line == 'ok':
+            tx_started = t
+    elif kind == TRACE_TX and tx_started != None:
+        tx_completions.append((t - tx_started, line))
+        tx_started = None
+    elif kind == TRACE_RX and rx_origin != None:
+        rx_frames.append((t - rx_origin, line))
+del(records, unanswered)
+
+#replayed radio state: 'idle', 'rx' or 'tx'
+radio_state = 'idle'
+state_lock = threading.Lock()
+write_lock = threading.Lock()
+last_responses = {}
+replay_start = None
+stats = {'commands': 0, 'fallback_responses': 0, 'frames_delivered': 0, 'frames_missed': 0, 'tx_count': 0, 'rx_turnarounds': []}
+last_rx_delivered = None
+
+master, slave = os.openpty()
+tty.setraw(slave)
+
+#function: write a response line to the service
+# accepts: response string
+def respond(response):
+    with write_lock:
+        os.write(master, response.encode('ASCII') + b'\r\n')
+
+#function: complete a transmission
+# accepts: radio_tx_ok or radio_err
+def tx_complete(result):
+    global radio_state
+    with state_lock:
+        radio_state = 'idle'
+    respond(result)
+
+#function: answer a single command from the service
+# accepts: command string (without line terminator)
+def handle_command(command):
+    global radio_state, replay_start, last_rx_delivered
+    stats['commands'] += 1
+    name = command_name(command.encode('ASCII'))
+    if replay_start == None and name == 'radio rx':
+        replay_start = time.monotonic()
+        threading.Thread(target=replay_frames, daemon=True).start()
+    if responses.get(name):
+        response = responses[name].popleft()
+        last_responses[name] = response
+    else:
+        stats['fallback_responses'] += 1
+        response = last_responses.get(name, 'ok')
+    with state_lock:
+        if name == 'radio rx' and response == 'ok':
+            radio_state = 'rx'
+            #time from delivering a frame until the radio is receiving again
+            if last_rx_delivered != None:
+                stats['rx_turnarounds'].append((time.monotonic() - last_rx_delivered) * 1000)
+                last_rx_delivered = None
+        elif name == 'radio rxstop' and radio_state == 'rx':
+            radio_state = 'idle'
+        elif name == 'radio tx' and response == 'ok':
+            radio_state = 'tx'
+    respond(response)
+    if name == 'radio tx' and response == 'ok':
+        stats['tx_count'] += 1
+        if tx_completions:
+            duration, result = tx_completions.popleft()
+        else:
+            duration, result = time_on_air(len(command.split()[-1]) // 2) / 1000, 'radio_tx_ok'
+        timer = threading.Timer(duration / args.speed, tx_complete, (result,))
+        timer.daemon = True
+        timer.start()
+
+#function: deliver the recorded frames at their recorded times
+#    note: frames arriving while the radio is not receiving are missed,
+#          matching the behavior of the RN2903 hardware
+def replay_frames():
+    global radio_state, last_rx_delivered
+    for t, line in rx_frames:
+        time.sleep(max(replay_start + t / args.speed - time.monotonic(), 0))
+        with state_lock:
+            if radio_state != 'rx':
+                stats['frames_missed'] += 1
+                continue
+            radio_state = 'idle'
+            last_rx_delivered = time.monotonic()
+        stats['frames_delivered'] += 1
+        respond(line)
+    print(f'All {len(rx_frames)} recorded frames replayed.')
+
+print(f'Replayed LoStik ({args.trace}) available at {os.ttyname(slave)}')
+print(f'{len(rx_frames)} frames and {len(tx_completions)} transmissions recorded, replaying at {args.speed:g}x')
+print('Press CTRL+C to quit.')
+
+buffer = b''
+try:
+    while True:
+        buffer += os.read(master, 1024)
+        while b'\r\n' in buffer:
+            line, buffer = buffer.split(b'\r\n', 1)
+            handle_command(line.decode('ASCII'))
+except (KeyboardInterrupt, OSError):
+    print()
+
+print(f'          Commands: {stats["commands"]}')
+print(f'Fallback Responses: {stats["fallback_responses"]}')
+print(f'  Frames Delivered: {stats["frames_delivered"]}')
+print(f'     Frames Missed: {stats["frames_missed"]}')
+print(f'     Transmissions: {stats["tx_count"]}')
+if stats['rx_turnarounds']:
+    rx_turnarounds = sorted(stats['rx_turnarounds'])
+    print(f'     RX Turnaround: {rx_turnarounds[len(rx_turnarounds) // 2]:.1f}ms median, {rx_turnarounds[-1]:.1f}ms max')
+os.close(master)
+os.close(slave)
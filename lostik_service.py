@@ -7,20 +7,38 @@
 ########################################################################
 
 #import from required 3rd party libraries
-from telnetlib import Telnet
 import serial
 import serial.tools.list_ports
 
 #import from project library
+from airtime import time_on_air
 from console import console
+import adr
+import airtime
+import archive
+import budget
+import dama
+import reassembly
+import reliability
+from lostik_driver import LoStikDriver
+from serial_trace import TraceWriter
 import lostik_settings
 import db
+import frames
+import metrics
+import notify
+import profiling
+import tdma
+import timesync
 import ui
 
 #import from standard library
-from datetime import datetime
+from collections import deque
+from math import ceil
 from sys import exit
 import argparse
+import asyncio
+import cProfile
 import time
 
 console.clear()
@@ -32,6 +50,34 @@ parser.add_argument('-p', '--power',
                     choices=['low','medium','high'],
                     help='LoStik transmit power (default: low)',
                     default='low')
+parser.add_argument('--port',
+                    action='append',
+                    help='serial port of the LoStik, repeat for each LoStik with --multi-radio (default: autodetect by VID:PID)')
+parser.add_argument('--multi-radio',
+                    action='store_true',
+                    help='use every LoStik at once, each on its own frequency from MULTI_RADIO_FREQ')
+parser.add_argument('--led',
+                    choices=['sync','deferred','off'],
+                    help='LoStik LED signalling (default: deferred)',
+                    default='deferred')
+parser.add_argument('--metrics-port',
+                    type=int,
+                    help='serve Prometheus metrics on this localhost TCP port')
+parser.add_argument('--metrics-file',
+                    help='periodically rewrite this file with metrics in JSON')
+parser.add_argument('--trace',
+                    metavar='FILE',
+                    help='record all serial traffic with the LoStik to FILE (FILE.1, FILE.2... for further LoStiks), see lostik_replay.py')
+parser.add_argument('--profile-spans',
+                    action='store_true',
+                    help='time radio control, database and UI calls and each phase of the radio loop, summarized on exit')
+parser.add_argument('--profile',
+                    metavar='FILE',
+                    help='run under cProfile and write the statistics to FILE on exit (for pstats or snakeviz)')
+parser.add_argument('--clock-skew',
+                    type=int,
+                    help='offset the TDMA clock by this many milliseconds (for testing time synchronization)',
+                    default=0)
 args = parser.parse_args()
 if args.power == 'low':
     SET_PWR = b'6'
@@ -60,262 +106,974 @@ elif args.power == 'high':
 #                This only took several months to figure out.          #
 ########################################################################
 
-#attempt LoStik detection, port assignment and connection.
-lostik = None
-lostik_port = None
-ports = serial.tools.list_ports.grep('1A86:7523')
-for port in ports:
-    lostik_port = port.device
-del(ports)
-if lostik_port == None:
+#attempt LoStik detection and port assignment
+lostik_ports = args.port
+if lostik_ports == None:
+    lostik_ports = [port.device for port in serial.tools.list_ports.grep('1A86:7523')]
+if not args.multi_radio:
+    lostik_ports = lostik_ports[-1:]
+if not lostik_ports:
     console.print('[bright_red][ERROR][/] LoStik not detected!')
     console.print('HELP: Check serial port descriptor and/or device connection.')
     exit(1)
-try:
-    lostik = serial.Serial(lostik_port, baudrate=57600, timeout=1)
-except:
-    console.print('[bright_red][ERROR][/] Unable to connect to LoStik!')
-    console.print('HELP: Check port permissions. User must be member of "dialout" group on Linux.')
-    exit(1)
-del(lostik_port)
 
-#check LoStik firmware version before proceeding
-lostik.write(b'sys get ver\r\n')
-if lostik.readline().decode('ASCII').rstrip() != lostik_settings.FIRMWARE_VERSION:
-    console.print('[bright_red][ERROR][/] LoStik failed to return expected firmware version!')
-    exit(1)
+#function: connect to a LoStik and initialize it for PiERS operation
+# accepts: serial port and its position among the ports
+# returns: LoStik driver, EUI-64 and time slot
+#    note: terminate on error, the frequency is set once every LoStik is
+#          connected
+def connect_lostik(port, index):
+    trace = None
+    if args.trace != None:
+        trace_path = args.trace if index == 0 else f'{args.trace}.{index}'
+        try:
+            trace = TraceWriter(trace_path)
+        except OSError as error:
+            console.print(f'[bright_red][ERROR][/] Unable to create trace file {trace_path}: {error.strerror}')
+            exit(1)
+    try:
+        lostik = LoStikDriver(port, args.led, trace)
+    except:
+        console.print('[bright_red][ERROR][/] Unable to connect to LoStik!')
+        console.print('HELP: Check port permissions. User must be member of "dialout" group on Linux.')
+        exit(1)
+
+    #check LoStik firmware version before proceeding
+    if lostik.command_blocking(b'sys get ver') != lostik_settings.FIRMWARE_VERSION:
+        console.print('[bright_red][ERROR][/] LoStik failed to return expected firmware version!')
+        exit(1)
 
-#get LoStik EUI-64 (globally unique 64-bit identifier)
-lostik.write(b'sys get hweui\r\n')
-HWEUI = lostik.readline().decode('ASCII').rstrip()
+    #get LoStik EUI-64 (globally unique 64-bit identifier)
+    hweui = lostik.command_blocking(b'sys get hweui')
 
-#use EUI-64 to determine time slot
-if HWEUI in lostik_settings.TIME_SLOT.keys():
-    MY_TIME_SLOT = lostik_settings.TIME_SLOT[HWEUI]
-else:
-    console.print('[bright_red][ERROR][/] LoStik is not registered with PiERS!')
+    #use EUI-64 to determine time slot
+    if hweui in lostik_settings.TIME_SLOT.keys():
+        time_slot = lostik_settings.TIME_SLOT[hweui]
+    else:
+        console.print(f'[bright_red][ERROR][/] LoStik {hweui} is not registered with PiERS!')
+        exit(1)
+
+    #attempt to pause mac (LoRaWAN) as required to issue commands directly to the radio
+    if lostik.command_blocking(b'mac pause') != '4294967245':
+        console.print('[bright_red][ERROR][/] Failed to disable LoRaWAN!')
+        exit(1)
+
+    #initialize lostik for PiERS operation
+    if lostik.command_blocking(b'radio set pwr ' + SET_PWR) != 'ok':
+        console.print('[bright_red][ERROR][/] Failed to set LoStik transmit power!')
+        exit(1)
+    if lostik.command_blocking(b'radio set sf ' + lostik_settings.SET_SF) != 'ok':
+        console.print('[bright_red][ERROR][/] Failed to set LoStik spreading factor!')
+        exit(1)
+    if lostik.command_blocking(b'radio set bw ' + lostik_settings.SET_BW) != 'ok':
+        console.print('[bright_red][ERROR][/] Failed to set LoStik radio bandwidth!')
+        exit(1)
+    if lostik.command_blocking(b'radio set cr ' + lostik_settings.SET_CR) != 'ok':
+        console.print('[bright_red][ERROR][/] Failed to set LoStik coding rate!')
+        exit(1)
+
+    # if lostik.command_blocking(b'radio set wdt ' + lostik_settings.SET_WDT) != 'ok':
+    #     console.print('[bright_red][ERROR][/] Failed to set LoStik watchdog timer time-out!')
+    #     exit(1)
+    return lostik, hweui, time_slot
+
+#connect every LoStik, in order of EUI-64 so that frequencies are assigned consistently
+lostiks = sorted((connect_lostik(port, index) for index, port in enumerate(lostik_ports)), key=lambda lostik: lostik[1])
+del(lostik_ports)
+if not args.multi_radio:
+    frequencies = [lostik_settings.SET_FREQ]
+elif len(lostiks) > len(lostik_settings.MULTI_RADIO_FREQ):
+    console.print(f'[bright_red][ERROR][/] {len(lostiks)} LoStiks attached but MULTI_RADIO_FREQ lists only {len(lostik_settings.MULTI_RADIO_FREQ)} frequencies!')
+    exit(1)
+elif len(set(lostik_settings.MULTI_RADIO_FREQ)) < len(lostik_settings.MULTI_RADIO_FREQ):
+    console.print('[bright_red][ERROR][/] MULTI_RADIO_FREQ lists a frequency more than once!')
     exit(1)
+else:
+    frequencies = lostik_settings.MULTI_RADIO_FREQ
+for (lostik, hweui, time_slot), frequency in zip(lostiks, frequencies):
+    if lostik.command_blocking(b'radio set freq ' + frequency) != 'ok':
+        console.print(f'[bright_red][ERROR][/] Failed to set LoStik {hweui} frequency!')
+        exit(1)
 
-#attempt to pause mac (LoRaWAN) as required to issue commands directly to the radio
-lostik.write(b'mac pause\r\n')
-if lostik.readline().decode('ASCII').rstrip() != '4294967245':
-    console.print('[bright_red][ERROR][/] Failed to disable LoRaWAN!')
+if args.multi_radio and (lostik_settings.DEMAND_ASSIGNMENT or lostik_settings.RELIABLE_DELIVERY
+                         or lostik_settings.TIME_SYNC):
+    console.print('[bright_red][ERROR][/] --multi-radio cannot be combined with DEMAND_ASSIGNMENT, RELIABLE_DELIVERY or TIME_SYNC!')
     exit(1)
 
-#initialize lostik for PiERS operation   
-lostik.write(b''.join([b'radio set pwr ', SET_PWR, b'\r\n']))
-if lostik.readline().decode('ASCII').rstrip() != 'ok':
-    console.print('[bright_red][ERROR][/] Failed to set LoStik transmit power!')
+########################################################################
+# Service Notes:  The service runs as a set of asyncio tasks sharing a #
+#                 single event loop.  The LoStik driver hands each     #
+#                 line received from the LoStik to the loop, the slot  #
+#                 timer sleeps until the next slot boundary computed   #
+#                 by the TDMA scheduler and opens the TX window, the   #
+#                 queue watcher reopens it when a message is queued    #
+#                 while my time slot is in progress.  The other tasks  #
+#                 only change the fields of the screen held in status, #
+#                 which the screen refresher draws on a worker thread  #
+#                 at most once per SCREEN_REFRESH_INTERVAL, so that    #
+#                 terminal output never delays switching the radio.    #
+#                                                                      #
+#                 Each LoStik is a Radio with its own controller task, #
+#                 time slot, TX window, spreading factor and air time  #
+#                 budget.  With --multi-radio every attached LoStik    #
+#                 runs at once on its own frequency, as a node of a    #
+#                 separate channel.  The radios share the TDMA clock,  #
+#                 the slot timer, the outbound queue and the inbound   #
+#                 messages, so whichever radio opens its TX window     #
+#                 first sends the next queued messages.  Demand        #
+#                 assignment, reliable delivery and time sync          #
+#                 coordinate the nodes of one channel and are only     #
+#                 available with a single radio.                       #
+########################################################################
+
+#establish TDMA scheduler, the TDMA clock is shared by every radio
+try:
+    scheduler = tdma.TdmaScheduler(lostiks[0][2],
+                                   lostik_settings.SLOT_COUNT,
+                                   lostik_settings.SLOT_LENGTH,
+                                   lostik_settings.GUARD_INTERVAL)
+    for lostik, hweui, time_slot in lostiks[1:]:
+        if not 1 <= time_slot <= scheduler.slot_count:
+            raise ValueError(f'time slot {time_slot} is outside of 1 to {scheduler.slot_count}')
+except ValueError as error:
+    console.print(f'[bright_red][ERROR][/] Invalid TDMA settings: {error}')
     exit(1)
-lostik.write(b''.join([b'radio set freq ', lostik_settings.SET_FREQ, b'\r\n']))
-if lostik.readline().decode('ASCII').rstrip() != 'ok':
-    console.print('[bright_red][ERROR][/] Failed to set LoStik frequency!')
+scheduler.adjust(args.clock_skew)
+
+if lostik_settings.DEMAND_ASSIGNMENT and lostik_settings.ADR:
+    console.print('[bright_red][ERROR][/] DEMAND_ASSIGNMENT cannot be combined with ADR!')
     exit(1)
-lostik.write(b''.join([b'radio set sf ', lostik_settings.SET_SF, b'\r\n']))
-if lostik.readline().decode('ASCII').rstrip() != 'ok':
-    console.print('[bright_red][ERROR][/] Failed to set LoStik spreading factor!')
+RETRANSMIT_INTERVAL = (scheduler.slot_count - 1) * scheduler.slot_length
+
+if ceil(lostik_settings.MAX_MESSAGE_LENGTH / lostik_settings.FRAGMENT_LENGTH) > 255:
+    console.print('[bright_red][ERROR][/] MAX_MESSAGE_LENGTH exceeds 255 fragments of FRAGMENT_LENGTH!')
     exit(1)
-lostik.write(b''.join([b'radio set bw ', lostik_settings.SET_BW, b'\r\n']))
-if lostik.readline().decode('ASCII').rstrip() != 'ok':
-    console.print('[bright_red][ERROR][/] Failed to set LoStik radio bandwidth!')
+
+#time synchronization state
+if not lostik_settings.TIME_SYNC:
+    TIME_SYNC_ROLE = None
+elif scheduler.my_time_slot == lostik_settings.TIME_SYNC_MASTER:
+    TIME_SYNC_ROLE = 'master'
+else:
+    TIME_SYNC_ROLE = 'follower'
+time_sync_samples = deque(maxlen=timesync.SAMPLE_COUNT)
+last_time_sync = None     #time (ms) a time sync frame was last sent or received
+tx_time_sync = False      #True if a time sync frame must precede the data frames
+clock_correction = 0      #total correction applied to the TDMA clock (ms)
+service_start = scheduler.now()
+
+#fields of the screen, drawn by screen_refresher()
+status = ui.ServiceStatus()
+total_air_time = 0        #air time used since the service started (ms)
+
+#asyncio primitives, created in main() once the event loop is running
+clock_adjusted = None
+
+BASE_SF = airtime.SF
+
+if lostik_settings.FRAME_ENCODING == 'ascii':
+    FRAME_TYPE = frames.FRAME_DATA_ASCII
+else:
+    FRAME_TYPE = frames.FRAME_DATA_PACKED
+
+FRAME_TYPE_NAMES = {frames.FRAME_BEACON: 'beacon', frames.FRAME_TIME_SYNC: 'time_sync',
+                    frames.FRAME_DEMAND: 'demand', frames.FRAME_ACK: 'ack',
+                    frames.FRAME_FRAGMENT_ASCII: 'fragment', frames.FRAME_FRAGMENT_PACKED: 'fragment'}
+
+#air time reserved at the start of every time slot for the owner's demand frame
+DEMAND_CONTROL_TIME = ceil(time_on_air(len(frames.pack_demand(scheduler.my_time_slot, 0))))
+
+#every fragment must fit a TX window at SET_SF, a fragment of . packs to the
+#most bytes (sent as ASCII)
+fragment_air_time = time_on_air(len(frames.pack_fragment(scheduler.my_time_slot, 0, 254, 255,
+                                                         '.' * lostik_settings.FRAGMENT_LENGTH, FRAME_TYPE,
+                                                         0 if lostik_settings.RELIABLE_DELIVERY else None)))
+window_air_time = min(scheduler.slot_length - 2 * scheduler.guard_interval, lostik_settings.AIRTIME_WINDOW_CAP)
+if lostik_settings.DEMAND_ASSIGNMENT:
+    window_air_time -= DEMAND_CONTROL_TIME
+if fragment_air_time > window_air_time:
+    console.print(f'[bright_red][ERROR][/] A fragment of FRAGMENT_LENGTH takes up to {ceil(fragment_air_time)}ms of air time but a TX window allows {window_air_time}ms!')
+    console.print('HELP: Reduce FRAGMENT_LENGTH or raise SLOT_LENGTH and AIRTIME_WINDOW_CAP.')
     exit(1)
-lostik.write(b''.join([b'radio set cr ', lostik_settings.SET_CR, b'\r\n']))
-if lostik.readline().decode('ASCII').rstrip() != 'ok':
-    console.print('[bright_red][ERROR][/] Failed to set LoStik coding rate!')
+del(fragment_air_time, window_air_time)
+
+#function: print an error and terminate
+# accepts: error message and optional help text
+def fatal(error, help=None):
+    console.clear()
+    console.print(f'[bright_red][ERROR][/] {error}')
+    if help != None:
+        console.print(f'HELP: {help}')
+    console.show_cursor(True)
     exit(1)
 
-# lostik.write(b''.join([b'radio set wdt ', lostik_settings.SET_WDT, b'\r\n']))
-# if lostik.readline().decode('ASCII').rstrip() != 'ok':
-#     console.print('[bright_red][ERROR][/] Failed to set LoStik watchdog timer time-out!')
-#     exit(1)
-
-#function: obtain rssi of last received packet
-# returns: rssi
-def get_rssi():
-    lostik.write(b'radio get rssi\r\n')
-    rssi = lostik.readline().decode('ASCII').rstrip()
-    return rssi
-
-#function: obtain snr of last received packet
-# returns: snr
-def get_snr():
-    lostik.write(b'radio get snr\r\n')
-    snr = lostik.readline().decode('ASCII').rstrip()
-    return snr
-
-#function: control blue led
-# accepts: boolean
-def blue_led(state):
-    if state == True:
-        lostik.write(b'sys set pindig GPIO10 1\r\n') #GPIO10 1 = blue tx led on
-    else:
-        lostik.write(b'sys set pindig GPIO10 0\r\n') #GPIO10 0 = blue tx led off
-    response = lostik.readline()
-
-#function: control red led
-# accepts: boolean
-def red_led(state):
-    if state == True:
-        lostik.write(b'sys set pindig GPIO11 1\r\n') #GPIO11 1 = red tx led on
-    else:
-        lostik.write(b'sys set pindig GPIO11 0\r\n') #GPIO11 0 = red tx led off
-    response = lostik.readline()
-
-#function: control lostik receive state
-# accepts: boolean
-#    note: terminate on error
-def rx(state):
-    if state == True:
-        #place LoStik in continuous receive mode
-        lostik.write(b'radio rx 0\r\n')
-        if lostik.readline().decode('ASCII').rstrip() == 'ok':
-            ui.lostik_service_update_lostik_state('rx')
-            blue_led(True)
+#function: show the air time left in the budgets of every radio
+#    note: rounded to the tenth of a second shown
+def update_budget_ui():
+    status.update('air_time_budget',
+                  round(sum(radio.airtime_budget.available(scheduler.now()) for radio in radios), -2),
+                  sum(radio.airtime_budget.capacity for radio in radios),
+                  any(radio.budget_deferred for radio in radios))
+
+#function: obtain the command to tune the LoStik to a spreading factor
+# accepts: spreading factor
+# returns: command (bytes)
+def set_sf_command(sf):
+    return b'radio set sf sf' + str(sf).encode('ASCII')
+
+#function: correct the TDMA clock from a time sync frame
+# accepts: frame length (bytes), spreading factor it was received with,
+#          master's time and time.monotonic() when the frame was received
+def time_sync(frame_length, sf, timestamp, time_read):
+    global last_time_sync, clock_correction
+    correction = timesync.clock_correction(time_sync_samples, timestamp,
+                                           time_on_air(frame_length, sf=sf),
+                                           lostik_settings.TIME_SYNC_DELAY,
+                                           scheduler.now(time_read))
+    scheduler.adjust(correction)
+    clock_correction += correction
+    last_time_sync = scheduler.now()
+    metrics.increment('piers_time_sync_frames_total')
+    status.update('time_sync', TIME_SYNC_ROLE, clock_correction)
+    if correction != 0:
+        clock_adjusted.set()
+
+#function: determine if a follower must hold its transmissions
+# returns: boolean
+#    note: until the first time sync frame has been received the TDMA clock
+#          may be far from that of its peers
+def awaiting_time_sync():
+    return (TIME_SYNC_ROLE == 'follower' and last_time_sync == None
+            and scheduler.now() - service_start < lostik_settings.TIME_SYNC_TIMEOUT)
+
+#function: count sent messages and how long they waited in the queue
+# accepts: list of dequeued messages (rowid, message, time_queued, priority)
+#          and time sent (ms)
+def count_sent_messages(dequeued, time_sent):
+    metrics.increment('piers_messages_sent_total', amount=len(dequeued))
+    for rowid, message, time_queued, priority in dequeued:
+        if time_queued != None:
+            metrics.observe('piers_queue_wait_milliseconds', time_sent - time_queued,
+                            f'priority="{db.PRIORITY_NAMES.get(priority, priority)}"')
+
+class Radio:
+    #accepts: position on screen, LoStik driver, EUI-64, time slot and
+    #         frequency (bytes)
+    def __init__(self, index, lostik, hweui, my_time_slot, frequency):
+        self.index = index
+        self.lostik = lostik
+        self.hweui = hweui
+        self.my_time_slot = my_time_slot
+        self.frequency = int(frequency)
+
+        #with a single radio, history recorded before radios were told apart counts
+        history_radio = hweui if args.multi_radio else None
+
+        #demand-assigned TDMA state
+        self.demand = {}               #cycle to dict of time slot to announced queue depth
+        self.tx_demand = False         #True if my demand frame must open the TX window
+        self.tx_data = True            #False if the TX window is for my demand frame only
+        self.tx_window_timer = None    #opens the TX window of a borrowed time slot
+
+        #reliable delivery state
+        if lostik_settings.RELIABLE_DELIVERY:
+            self.retransmit_buffer = reliability.RetransmitBuffer(
+                set(lostik_settings.TIME_SLOT.values()) - {my_time_slot}, db.last_sequence())
         else:
-            console.clear()
-            console.print('[bright_red][ERROR][/] Serial interface is busy, unable to communicate with LoStik!')
-            console.print('HELP: Disconnect and reconnect LoStik device, then try again.')
-            console.show_cursor(True)
-            exit(1)
-    else:
-        #halt LoStik continuous receive mode
-        lostik.write(b'radio rxstop\r\n')
-        if lostik.readline().decode('ASCII').rstrip() == 'ok':
-            ui.lostik_service_update_lostik_state('idle')
-            blue_led(False)
+            self.retransmit_buffer = None
+        self.receive_windows = {}      #sender to (highest sequence number, bitmap) of frames heard
+        self.ack_pending = set()       #senders heard from since my last ACK frame
+        self.tx_ack = None             #ACK frame to send in the open TX window
+        self.tx_retransmissions = []   #(sequence number, payload) to resend in the open TX window
+
+        #fragmentation state
+        self.reassembly_buffer = reassembly.ReassemblyBuffer(lostik_settings.REASSEMBLY_CAPACITY,
+                                                             lostik_settings.REASSEMBLY_TIMEOUT)
+
+        #establish air time budget, charged with the transmissions of the last period
+        self.airtime_budget = budget.AirtimeBudget(lostik_settings.AIRTIME_BUDGET,
+                                                   lostik_settings.AIRTIME_BUDGET_PERIOD,
+                                                   lostik_settings.AIRTIME_WINDOW_CAP)
+        self.airtime_budget.replay(db.transmissions_since(scheduler.now() - lostik_settings.AIRTIME_BUDGET_PERIOD,
+                                                          history_radio))
+        self.budget_deferred = False   #True if the budget held back messages in the TX window
+
+        #asyncio primitives, created in start() once the event loop is running
+        self.tx_window = None
+        self.tx_window_open = 0
+        self.tx_window_close = 0
+        self.slot_changed = None
+
+        #adaptive data rate state
+        self.radio_sf = BASE_SF        #spreading factor the LoStik is tuned to
+        self.rx_since = None           #time.monotonic() radio rx 0 was last written, None
+                                       #once the LoStik has left receive mode
+        self.tx_sf = BASE_SF           #spreading factor for data frames in the open TX window
+        self.tx_beacon = False         #True if a beacon must precede the data frames
+        self.announced_sf = BASE_SF    #spreading factor last announced in my beacon
+        self.announced_until = 0       #time (ms) my announcement expires
+        self.peer_rates = {}           #time slot of peer to (announced sf, expiry time)
+        self.peers = {}                #link quality history, see adr.py
+        for sender, snr, time_received in db.recent_link_quality(100, history_radio):
+            adr.record_snr(self.peers, sender, snr, time_received)
+
+    #function: create the asyncio primitives and start the LoStik driver,
+    #          call from within the event loop
+    def start(self):
+        self.tx_window = asyncio.Event()
+        self.slot_changed = asyncio.Event()
+        self.lostik.start()
+
+    #function: control lostik receive state
+    # accepts: boolean and, when entering receive, queries to send first
+    # returns: responses to the queries
+    #    note: the queries and radio rx 0 are written in a single round trip,
+    #          preceded by radio rxstop if the LoStik may still be receiving,
+    #          terminate on error
+    async def rx(self, state, *queries):
+        if state == True:
+            if self.rx_since != None and not queries:
+                return [] #still receiving
+            stop = self.rx_since != None
+            while True:
+                #place LoStik in continuous receive mode
+                self.rx_since = time.monotonic()
+                commands = [*queries, b'radio rx 0']
+                if stop:
+                    commands.insert(0, b'radio rxstop')
+                responses = await self.lostik.commands(*commands)
+                if responses[-1] != 'busy' or stop:
+                    break
+                #a frame was delivered while radio rx 0 was written, the
+                #LoStik re-entered receive mode on the earlier command
+                stop = True
+            if responses[-1] == 'ok' and (not stop or responses[0] == 'ok'):
+                status.update('lostik_state', 'rx', radio=self.index)
+                await self.lostik.led('blue', True)
+            else:
+                fatal('Serial interface is busy, unable to communicate with LoStik!',
+                      'Disconnect and reconnect LoStik device, then try again.')
+            return responses[1:-1] if stop else responses[:-1]
         else:
-            console.clear()
-            console.print('[bright_red][ERROR][/] Serial interface is busy, unable to communicate with LoStik!')
-            console.print('HELP: Disconnect and reconnect LoStik device, then try again.')
-            console.show_cursor(True)
-            exit(1)
+            #halt LoStik continuous receive mode
+            self.rx_since = None
+            if await self.lostik.command(b'radio rxstop') == 'ok':
+                status.update('lostik_state', 'idle', radio=self.index)
+                await self.lostik.led('blue', False)
+            else:
+                fatal('Serial interface is busy, unable to communicate with LoStik!',
+                      'Disconnect and reconnect LoStik device, then try again.')
 
-#function: attempt to transmit outbound message
-# accepts: message
-# returns: time_sent and air_time
-#    note: terminate on error
-def tx(message):
-    tx_start_time = 0
-    tx_end_time = 0
-    time_sent = 0
-    air_time = 0
-    message_hex = message.encode('ASCII').hex()
-    tx_command_elements = 'radio tx ' + message_hex + '\r\n'
-    tx_command = tx_command_elements.encode('ASCII')
-    lostik.write(tx_command)
-    if lostik.readline().decode('ASCII').rstrip() == 'ok':
-        tx_start_time = int(round(time.time()*1000))
-        ui.lostik_service_update_lostik_state('tx')
-        red_led(True)
-    else:
-        console.clear()
-        console.print('[bright_red][ERROR][/] Transmit failure!')
-        console.show_cursor(True)
-        exit(1)
-    response = ''
-    while response == '':
-        response = lostik.readline().decode('ASCII').rstrip()
-    else:
-        if response == 'radio_tx_ok':
+    #function: attempt to transmit a frame
+    # accepts: payload (bytes)
+    # returns: time_sent and air_time
+    #    note: terminate on error
+    async def tx(self, payload):
+        global total_air_time
+        if await self.lostik.transmit(payload) == 'ok':
+            tx_start_time = int(round(time.time()*1000))
+            status.update('lostik_state', 'tx', radio=self.index)
+            await self.lostik.led('red', True)
+        else:
+            fatal('Transmit failure!')
+        if await self.lostik.transmission() == 'radio_tx_ok':
             tx_end_time = int(round(time.time()*1000))
             time_sent = tx_end_time
             air_time = tx_end_time - tx_start_time
-            ui.lostik_service_update_total_air_time(air_time)
-            ui.lostik_service_update_lostik_state('idle')
-            red_led(False)
+            metrics.increment('piers_frames_sent_total')
+            metrics.observe('piers_tx_air_time_milliseconds', air_time)
+            metrics.transmission(air_time)
+            self.airtime_budget.consume(air_time, scheduler.now(), self.tx_window_open)
+            update_budget_ui()
+            total_air_time += air_time
+            status.update('total_air_time', total_air_time)
+            status.update('lostik_state', 'idle', radio=self.index)
+            await self.lostik.led('red', False)
             return time_sent, air_time
-        elif response == 'radio_err':
-            console.clear()
-            console.print('[bright_red][ERROR][/] Transmit failure!')
-            console.show_cursor(True)
-            exit(1)
+        else:
+            fatal('Transmit failure!')
 
-TS1_LIST = [0,1,2,3,4,10,11,12,13,14,20,21,22,23,24,30,31,32,33,34,40,41,42,43,44,50,51,52,53,54]
-TS2_LIST = [5,6,7,8,9,15,16,17,18,19,25,26,27,28,29,35,36,37,38,39,45,46,47,48,49,55,56,57,58,59]
-current_time_slot = None
-
-def refresh_time_slot(current_second):
-    global current_time_slot
-    if current_second in TS1_LIST:
-        current_time_slot = 1
-    if current_second in TS2_LIST:
-        current_time_slot = 2
-    ui.lostik_service_update_current_time_slot(current_time_slot)
-
-TS1_TX_LIST = [0,10,20,30,40,50]
-TS2_TX_LIST = [5,15,25,35,45,55]
-tx_window_open = None
-
-def refresh_tx_window(current_second):
-    global tx_window_open
-    if MY_TIME_SLOT == 1:
-        if current_second in TS1_TX_LIST:
-            tx_window_open = True
+    #function: count a TX window in which the budget held back messages
+    def report_budget_deferral(self):
+        if self.budget_deferred:
+            metrics.increment('piers_budget_deferrals_total')
+            update_budget_ui()
+
+    #function: determine the spreading factor to receive with in a time slot
+    # accepts: time slot
+    # returns: spreading factor
+    def rx_sf(self, time_slot):
+        sf, expiry = self.peer_rates.get(time_slot, (BASE_SF, 0))
+        if scheduler.now() < expiry:
+            return sf
+        return BASE_SF
+
+    #function: record the spreading factor the LoStik was tuned to
+    # accepts: spreading factor and the response to radio set sf
+    #    note: terminate on error
+    def tuned(self, sf, response):
+        if response != 'ok':
+            fatal('Failed to set LoStik spreading factor!')
+        self.radio_sf = sf
+        status.update('spreading_factor', sf, radio=self.index)
+
+    #function: retune the LoStik while receiving, if required for the time slot
+    async def retune(self):
+        sf = self.rx_sf(scheduler.time_slot(scheduler.now()))
+        if sf != self.radio_sf:
+            set_sf_response, = await self.rx(True, set_sf_command(sf))
+            self.tuned(sf, set_sf_response)
+
+    #function: record a queue depth announced in a demand frame
+    # accepts: time slot, queue depth and time announced (ms)
+    def record_demand(self, time_slot, depth, t):
+        cycle = scheduler.cycle(t)
+        self.demand.setdefault(cycle, {})[time_slot] = depth
+        for old_cycle in [old_cycle for old_cycle in self.demand if old_cycle < cycle - 1]:
+            del self.demand[old_cycle]
+
+    #function: obtain the queue depth to announce in my demand frame
+    # returns: queue depth
+    #    note: the time sync master announces a backlog whenever a time sync
+    #          frame will be due in the next cycle so that it keeps its time
+    #          slot, as does a node with frames to acknowledge or awaiting
+    #          acknowledgement
+    def demand_depth(self):
+        depth = db.queue_depth()
+        if TIME_SYNC_ROLE == 'master':
+            now = scheduler.now()
+            time_synced = now if tx_time_sync else last_time_sync
+            if (time_synced == None or now + scheduler.slot_count * scheduler.slot_length - time_synced
+                    >= lostik_settings.TIME_SYNC_INTERVAL):
+                depth = max(depth, 1)
+        if self.ack_pending or (self.retransmit_buffer != None and self.retransmit_buffer.frames):
+            depth = max(depth, 1)
+        return min(depth, dama.MAX_DEPTH)
+
+    #function: store a frame received by the LoStik and resume receiving
+    # accepts: radio_rx or radio_err line received from the LoStik and
+    #          time.monotonic() when it was read
+    #    note: the LoStik leaves receive mode after each frame, rssi and snr
+    #          (and any change of spreading factor announced by a beacon) are
+    #          sent in the same round trip that resumes receiving.  A line
+    #          read before radio rx 0 was last written was delivered ahead of
+    #          a transmission or retune, and the LoStik is receiving again.
+    async def receive(self, line, time_read):
+        if self.rx_since != None and time_read >= self.rx_since:
+            self.rx_since = None #the LoStik left receive mode to deliver the line
+        if not line.startswith('radio_rx'):
+            await self.rx(True)
+            return
+        metrics.frame_received()
+        try:
+            payload = bytes.fromhex(line.split()[1])
+            frame_type, sender, contents = frames.unpack_frame(payload)
+        except (IndexError, ValueError):
+            metrics.increment('piers_decode_errors_total')
+            await self.rx(True)
+            return #malformed frame
+        metrics.increment('piers_frames_received_total',
+                          f'type="{FRAME_TYPE_NAMES.get(frame_type & ~frames.FRAME_SEQUENCED, "data")}"')
+        if (frame_type == frames.FRAME_TIME_SYNC and TIME_SYNC_ROLE == 'follower'
+                and sender == lostik_settings.TIME_SYNC_MASTER):
+            time_sync(len(payload), self.radio_sf, contents, time_read)
+        if frame_type == frames.FRAME_DEMAND and sender != None:
+            self.record_demand(sender, contents, scheduler.now(time_read))
+            if self.tx_window_timer != None and sender == scheduler.time_slot(scheduler.now()):
+                #the owner of the time slot I borrowed is done, open my TX window
+                self.tx_window_timer.cancel()
+                self.tx_window_timer = None
+                self.tx_window_open = min(self.tx_window_open, scheduler.now())
+                self.tx_window.set()
+        queries = [b'radio get rssi', b'radio get snr']
+        if frame_type == frames.FRAME_BEACON:
+            self.peer_rates[sender] = (contents, scheduler.now() + lostik_settings.ADR_LEASE)
+            sf = self.rx_sf(scheduler.time_slot(scheduler.now()))
+            if sf != self.radio_sf:
+                queries.append(set_sf_command(sf))
+        responses = await self.rx(True, *queries)
+        rssi, snr = responses[:2]
+        if len(responses) == 3:
+            self.tuned(sf, responses[2])
+        if sender != None:
+            try:
+                adr.record_snr(self.peers, sender, float(snr), scheduler.now())
+            except ValueError:
+                pass
+        if frame_type & frames.FRAME_SEQUENCED:
+            sequence, contents = contents
+            if self.retransmit_buffer != None:
+                self.receive_windows[sender], new = reliability.receive_sequence(self.receive_windows.get(sender),
+                                                                                 sequence)
+                self.ack_pending.add(sender)
+                if not new:
+                    metrics.increment('piers_duplicate_frames_total')
+                    contents = []
+        if frame_type & ~frames.FRAME_SEQUENCED in (frames.FRAME_FRAGMENT_ASCII, frames.FRAME_FRAGMENT_PACKED) and contents:
+            dropped = self.reassembly_buffer.dropped
+            message = self.reassembly_buffer.add(sender, *contents, scheduler.now())
+            if self.reassembly_buffer.dropped > dropped:
+                metrics.increment('piers_reassembly_dropped_total', amount=self.reassembly_buffer.dropped - dropped)
+            if message == None:
+                contents = []
+            else:
+                contents = [message]
+                metrics.increment('piers_messages_reassembled_total')
+        if frame_type == frames.FRAME_ACK and self.retransmit_buffer != None:
+            for peer, last, bitmap in contents:
+                if peer == self.my_time_slot:
+                    self.acknowledge(sender, last, bitmap)
+        if frame_type not in (frames.FRAME_BEACON, frames.FRAME_TIME_SYNC, frames.FRAME_DEMAND, frames.FRAME_ACK) and contents:
+            db.insert_inbound_messages(contents,rssi,snr,sender,self.radio_sf,self.hweui,self.frequency)
+
+    #function: apply an acknowledgement of my frames from a peer
+    # accepts: peer and its receive window for my frames
+    def acknowledge(self, peer, last, bitmap):
+        delivered = self.retransmit_buffer.acknowledge(peer, last, bitmap)
+        if delivered:
+            db.update_acknowledged_outbound_messages(delivered)
+            metrics.increment('piers_messages_acknowledged_total', amount=len(delivered))
+
+    #function: determine if messages can be sent together in one frame
+    # accepts: list of queued messages (rowid, message, time_queued, priority)
+    # returns: boolean
+    #    note: admission control, a frame that would still be on air when the
+    #          TX window closes or that would exceed the air time budget is
+    #          refused and its messages stay queued, as are messages for which
+    #          no more frames may be kept for retransmission.  A message
+    #          longer than FRAGMENT_LENGTH is sent alone, if its next fragment
+    #          fits.
+    def frame_fits(self, records):
+        if self.retransmit_buffer == None:
+            sequence = None
+        elif self.retransmit_buffer.full():
+            return False
         else:
-            tx_window_open = False
-    if MY_TIME_SLOT == 2:
-        if current_second in TS2_TX_LIST:
-            tx_window_open = True
+            sequence = self.retransmit_buffer.next_sequence
+        messages = [message for rowid, message, time_queued, priority in records]
+        if any(len(message) > lostik_settings.FRAGMENT_LENGTH for message in messages):
+            if len(messages) > 1:
+                return False
+            rowid, message = records[0][:2]
+            index = db.fragment_progress(rowid)[0]
+            fragment_length = lostik_settings.FRAGMENT_LENGTH
+            return self.payload_fits(len(frames.pack_fragment(self.my_time_slot, rowid % 256, index,
+                                                              ceil(len(message) / fragment_length),
+                                                              message[index * fragment_length:(index + 1) * fragment_length],
+                                                              FRAME_TYPE, sequence)))
+        frame_length = len(frames.pack_data_frame(self.my_time_slot, messages, FRAME_TYPE, sequence))
+        if frame_length > lostik_settings.MAX_FRAME_LENGTH:
+            return False
+        return self.payload_fits(frame_length)
+
+    #function: determine if a frame can be sent in the open TX window
+    # accepts: frame length (bytes)
+    # returns: boolean
+    #    note: the frame must fit after the control frames and retransmissions
+    #          still to be sent in the window
+    def payload_fits(self, frame_length):
+        now = scheduler.now()
+        remaining_time = self.tx_window_close - max(now, self.tx_window_open)
+        air_time = time_on_air(frame_length, sf=self.tx_sf)
+        if self.tx_beacon:
+            air_time += time_on_air(len(frames.pack_beacon(self.my_time_slot, self.tx_sf)))
+        if tx_time_sync:
+            air_time += time_on_air(len(frames.pack_time_sync(self.my_time_slot, now)), sf=self.tx_sf)
+        if self.tx_demand:
+            air_time += DEMAND_CONTROL_TIME
+        if self.tx_ack != None:
+            air_time += time_on_air(len(self.tx_ack), sf=self.tx_sf)
+        for sequence, payload in self.tx_retransmissions:
+            air_time += time_on_air(len(payload), sf=self.tx_sf)
+        if air_time > remaining_time:
+            return False
+        if air_time > self.airtime_budget.available(now, self.tx_window_open):
+            self.budget_deferred = True
+            return False
+        return True
+
+    #function: choose the spreading factor for the open TX window
+    #    note: a beacon is required whenever the chosen spreading factor
+    #          differs from the one receivers will otherwise expect during my
+    #          time slot
+    def plan_tx_rate(self):
+        if not lostik_settings.ADR:
+            self.tx_sf, self.tx_beacon = BASE_SF, False
+            return
+        now = scheduler.now()
+        self.tx_sf = adr.choose_sf(self.peers, now, BASE_SF, lostik_settings.ADR_MARGIN,
+                                   lostik_settings.ADR_PEER_TIMEOUT)
+        if now + scheduler.slot_length < self.announced_until:
+            expected_sf = self.announced_sf
         else:
-            tx_window_open = False
+            expected_sf = BASE_SF
+        self.tx_beacon = self.tx_sf != expected_sf
+
+    #function: prepare the ACK frame and retransmissions for the open TX window
+    #    note: retransmissions that do not fit wait for my next TX window
+    def plan_reliable_delivery(self):
+        self.tx_ack, self.tx_retransmissions = None, []
+        if self.retransmit_buffer == None or not self.tx_data:
+            return
+        if self.ack_pending:
+            self.tx_ack = frames.pack_ack(self.my_time_slot, [(sender, *self.receive_windows[sender])
+                                                              for sender in sorted(self.ack_pending)])
+        retransmissions, abandoned = self.retransmit_buffer.due(scheduler.now(), RETRANSMIT_INTERVAL,
+                                                                lostik_settings.RETRANSMIT_LIMIT)
+        if abandoned:
+            metrics.increment('piers_messages_unacknowledged_total', amount=len(abandoned))
+        for sequence, payload in retransmissions:
+            if not self.payload_fits(len(payload)):
+                break
+            self.tx_retransmissions.append((sequence, payload))
+
+    #function: tune the LoStik while it is not receiving
+    # accepts: spreading factor
+    async def tune_idle(self, sf):
+        if sf != self.radio_sf:
+            self.tuned(sf, await self.lostik.command(set_sf_command(sf)))
+
+    #function: take the next queued messages that fit in the open TX window
+    # returns: list of (rowid, message, time_queued, priority)
+    #    note: with --multi-radio a long message part way through is only
+    #          taken by the LoStik that began it
+    def dequeue(self):
+        return db.dequeue_outbound_messages(self.frame_fits, lostik_settings.PRIORITY_AGING,
+                                            radio=self.hweui if args.multi_radio else None)
+
+    #function: send the fragments of a long message that fit in the open TX window
+    # accepts: dequeued message (rowid, message, time_queued, priority)
+    # returns: True if a fragment was sent
+    #    note: a message not sent in full returns to the queue and continues
+    #          with its next fragment in my next TX window
+    async def transmit_fragments(self, record):
+        rowid, message, time_queued, priority = record
+        fragment_length = lostik_settings.FRAGMENT_LENGTH
+        count = ceil(len(message) / fragment_length)
+        index, previous_air_time = db.fragment_progress(rowid)
+        first_index = index
+        window_air_time = 0
+        while index < count:
+            sequence = None if self.retransmit_buffer == None else self.retransmit_buffer.next_sequence
+            fragment = message[index * fragment_length:(index + 1) * fragment_length]
+            payload = frames.pack_fragment(self.my_time_slot, rowid % 256, index, count, fragment, FRAME_TYPE, sequence)
+            if (self.retransmit_buffer != None and self.retransmit_buffer.full()) or not self.payload_fits(len(payload)):
+                break
+            time_sent, air_time = await self.tx(payload)
+            index += 1
+            window_air_time += air_time
+            if self.retransmit_buffer != None:
+                self.retransmit_buffer.add(sequence, payload, [rowid], scheduler.now(), index == count)
+            metrics.increment('piers_fragments_sent_total')
+        if index < count:
+            db.update_fragments_sent(rowid, index, window_air_time, self.hweui)
+            return index > first_index
+        db.update_sent_outbound_messages([(rowid, time_sent, previous_air_time + window_air_time)],
+                                         self.tx_sf, sequence, self.hweui, self.frequency)
+        count_sent_messages([record], time_sent)
+        return True
+
+    #function: transmit during an open TX window
+    # returns: True if the LoStik was taken out of receive mode
+    #    note: frames are sent back to back, each carrying as many queued
+    #          messages as fit, until the queue is empty or the next frame
+    #          would not finish before the TX window closes.  In demand-
+    #          assigned mode my time slot opens with my demand frame and the
+    #          time sync master then sends a time sync frame when one is due,
+    #          whether or not anything is queued.  With reliable delivery my
+    #          ACK frame and any retransmissions come before new data frames.
+    async def transmit_window(self):
+        global tx_time_sync, last_time_sync
+        self.tx_window.clear()
+        if awaiting_time_sync():
+            return False
+        self.plan_tx_rate()
+        tx_time_sync = (self.tx_data and TIME_SYNC_ROLE == 'master' and
+                        (last_time_sync == None or
+                         scheduler.now() - last_time_sync >= lostik_settings.TIME_SYNC_INTERVAL))
+        self.budget_deferred = False
+        self.plan_reliable_delivery()
+        if self.tx_data:
+            dequeued = self.dequeue()
+        else:
+            dequeued = []
+        if not dequeued:
+            self.tx_beacon = False
+            if not tx_time_sync and not self.tx_demand and self.tx_ack == None and not self.tx_retransmissions:
+                self.report_budget_deferral()
+                return False
+        await self.rx(False)
+        await asyncio.sleep(max(self.tx_window_open - scheduler.now(), 0) / 1000)
+        if self.tx_demand:
+            depth = self.demand_depth()
+            await self.tx(frames.pack_demand(self.my_time_slot, depth))
+            self.record_demand(self.my_time_slot, depth, self.tx_window_open)
+            self.tx_demand = False
+        if self.tx_beacon:
+            await self.tune_idle(BASE_SF)
+            await self.tx(frames.pack_beacon(self.my_time_slot, self.tx_sf))
+            self.announced_sf, self.announced_until = self.tx_sf, scheduler.now() + lostik_settings.ADR_LEASE
+            self.tx_beacon = False
+        await self.tune_idle(self.tx_sf)
+        if tx_time_sync:
+            await self.tx(frames.pack_time_sync(self.my_time_slot, scheduler.now()))
+            last_time_sync = scheduler.now()
+            tx_time_sync = False
+            metrics.increment('piers_time_sync_frames_total')
+        if self.tx_ack != None:
+            await self.tx(self.tx_ack)
+            self.ack_pending.clear()
+            self.tx_ack = None
+        while self.tx_retransmissions:
+            sequence, payload = self.tx_retransmissions.pop(0)
+            time_sent, air_time = await self.tx(payload)
+            self.retransmit_buffer.retransmitted(sequence, scheduler.now())
+            metrics.increment('piers_retransmissions_total')
+        while dequeued:
+            if len(dequeued[0][1]) > lostik_settings.FRAGMENT_LENGTH:
+                if not await self.transmit_fragments(dequeued[0]):
+                    break #its next fragment no longer fits, dequeuing again would spin
+                dequeued = self.dequeue()
+                continue
+            messages = [message for rowid, message, time_queued, priority in dequeued]
+            sequence = None if self.retransmit_buffer == None else self.retransmit_buffer.next_sequence
+            payload = frames.pack_data_frame(self.my_time_slot, messages, FRAME_TYPE, sequence)
+            time_sent, air_time = await self.tx(payload)
+            if self.retransmit_buffer != None:
+                self.retransmit_buffer.add(sequence, payload,
+                                           [rowid for rowid, message, time_queued, priority in dequeued],
+                                           scheduler.now())
+            #share the frame's air time between its messages by record length
+            record_lengths = frames.record_lengths(messages, FRAME_TYPE)
+            db.update_sent_outbound_messages(
+                [(rowid, time_sent, round(air_time * record_length / sum(record_lengths)))
+                 for (rowid, message, time_queued, priority), record_length in zip(dequeued, record_lengths)],
+                self.tx_sf, sequence, self.hweui, self.frequency)
+            count_sent_messages(dequeued, time_sent)
+            dequeued = self.dequeue()
+        self.report_budget_deferral()
+        return True
+
+    #task: switch the LoStik between receive and transmit
+    #    note: with --profile-spans each iteration is split into the time
+    #          spent waiting and handling each event (see profiling.py)
+    async def controller(self):
+        await self.rx(True)
+        while True:
+            metrics.increment('piers_loop_iterations_total')
+            phase_start = profiling.phase_start()
+            line_task = asyncio.ensure_future(self.lostik.rx_line())
+            window_task = asyncio.ensure_future(self.tx_window.wait())
+            slot_task = asyncio.ensure_future(self.slot_changed.wait())
+            done, pending = await asyncio.wait({line_task, window_task, slot_task},
+                                               return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            phase_start = profiling.phase('wait', phase_start)
+            if line_task in done:
+                await self.receive(*line_task.result())
+                phase_start = profiling.phase('receive', phase_start)
+            if window_task in done:
+                if await self.transmit_window():
+                    await self.rx(True)
+                phase_start = profiling.phase('transmit', phase_start)
+            if slot_task in done:
+                self.slot_changed.clear()
+                await self.retune()
+                profiling.phase('retune', phase_start)
+
+    #function: determine my use of a time slot
+    # accepts: start time of the time slot (ms)
+    # returns: TX window open and close times (ms), whether my demand frame is
+    #          to be sent and whether data may be sent, or None if the time
+    #          slot is not mine to use
+    def slot_window(self, slot_start):
+        time_slot = scheduler.time_slot(slot_start)
+        window_open, window_close = scheduler.tx_window(slot_start)
+        if not lostik_settings.DEMAND_ASSIGNMENT:
+            if time_slot == self.my_time_slot:
+                return window_open, window_close, False, True
+            return None
+        cycle = scheduler.cycle(slot_start)
+        my_time_slots = dama.my_time_slots(self.my_time_slot, scheduler.slot_count, self.demand.get(cycle - 1, {}))
+        if time_slot == self.my_time_slot:
+            return window_open, window_close, True, time_slot in my_time_slots
+        if time_slot in my_time_slots:
+            #borrowed, the owner's demand frame comes first (see receive)
+            metrics.increment('piers_borrowed_slots_total')
+            return (window_open + DEMAND_CONTROL_TIME + 2 * scheduler.guard_interval,
+                    window_close, False, True)
+        return None
+
+    #function: open the TX window if I may use a time slot
+    # accepts: start time of the time slot (ms)
+    #    note: a demand frame is only sent at the start of my time slot, never
+    #          once a borrower may be transmitting.  In a borrowed time slot
+    #          the TX window opens once the owner's demand frame has been
+    #          received, or after the time allowed for it if the frame is
+    #          lost.
+    def open_tx_window(self, slot_start):
+        if self.tx_window_timer != None:
+            self.tx_window_timer.cancel()
+            self.tx_window_timer = None
+        window = self.slot_window(slot_start)
+        if window == None:
+            return
+        self.tx_window_open, self.tx_window_close, self.tx_demand, self.tx_data = window
+        now = scheduler.now()
+        if self.tx_demand and now > self.tx_window_open:
+            self.tx_demand = False
+        if not (self.tx_demand or self.tx_data) or now >= self.tx_window_close:
+            return
+        delay = self.tx_window_open - scheduler.guard_interval - now
+        if delay > 0:
+            self.tx_window_timer = asyncio.get_event_loop().call_later(delay / 1000, self.tx_window.set)
+        else:
+            self.tx_window.set()
+
+#establish a radio for every LoStik
+try:
+    radios = [Radio(index, lostik, hweui, time_slot, frequency)
+              for index, ((lostik, hweui, time_slot), frequency) in enumerate(zip(lostiks, frequencies))]
+except ValueError as error:
+    console.print(f'[bright_red][ERROR][/] Invalid reassembly or air time budget settings: {error}')
+    exit(1)
+del(lostiks)
+
+#time the calls on the hot path
+if args.profile_spans:
+    profiling.enable()
+    profiling.instrument_methods(Radio, ('rx', 'tx', 'receive', 'transmit_window', 'transmit_fragments', 'retune'))
+    profiling.instrument_methods(LoStikDriver, ('command', 'commands', 'transmit', 'transmission', 'led'))
+    profiling.instrument_module(db)
+    profiling.instrument_module(ui, 'lostik_service_update_')
+
+#task: track TDMA slot boundaries and open the TX window of every radio
+#    note: starts over whenever time synchronization corrects the clock
+async def slot_timer():
+    while True:
+        clock_adjusted.clear()
+        now = scheduler.now()
+        status.update('current_time_slot', scheduler.time_slot(now), scheduler.slot_count)
+        for radio in radios:
+            radio.open_tx_window(scheduler.slot_start(now)) #started (or corrected to) during a time slot
+            radio.slot_changed.set()
+        while not clock_adjusted.is_set():
+            now = scheduler.now()
+            next_slot_start = scheduler.next_slot_start(now)
+            try:
+                await asyncio.wait_for(clock_adjusted.wait(), (next_slot_start - now) / 1000)
+                break
+            except asyncio.TimeoutError:
+                pass
+            current_time_slot = scheduler.time_slot(next_slot_start)
+            for radio in radios:
+                radio.open_tx_window(next_slot_start)
+                radio.slot_changed.set()
+            status.update('current_time_slot', current_time_slot, scheduler.slot_count)
+            update_budget_ui()
+
+#task: wake the radio controllers when new_message.py queues a message
+async def queue_watcher():
+    subscription = notify.subscribe('queue')
+    if subscription == None:
+        return #messages are still picked up when the next TX window opens
+    loop = asyncio.get_running_loop()
+    woken = asyncio.Event()
+    loop.add_reader(subscription.fileno(), woken.set)
+    try:
+        while True:
+            await woken.wait()
+            woken.clear()
+            notify.wait(subscription, 0)
+            for radio in radios:
+                if radio.tx_window_open <= scheduler.now() < radio.tx_window_close:
+                    radio.tx_window.set()
+    finally:
+        loop.remove_reader(subscription.fileno())
+        notify.unsubscribe(subscription)
+
+#task: move old messages into the archives, on a worker thread so that the
+#      radio controllers never wait for it
+async def compactor():
+    loop = asyncio.get_running_loop()
+    while True:
+        archived = await loop.run_in_executor(None, archive.compact)
+        if archived:
+            metrics.increment('piers_messages_archived_total', amount=archived)
+        await asyncio.sleep(lostik_settings.COMPACTION_INTERVAL / 1000)
+
+#task: draw the fields of the screen that changed, at most once per
+#      SCREEN_REFRESH_INTERVAL and on a worker thread so that a slow terminal
+#      never holds up the radio controllers
+async def screen_refresher():
+    loop = asyncio.get_running_loop()
+    while True:
+        changes = status.changes()
+        if changes:
+            await loop.run_in_executor(None, ui.lostik_service_redraw, changes)
+        await asyncio.sleep(lostik_settings.SCREEN_REFRESH_INTERVAL / 1000)
+
+async def main():
+    global clock_adjusted
+    clock_adjusted = asyncio.Event()
+    for radio in radios:
+        radio.start()
+    tasks = [radio.controller() for radio in radios] + [slot_timer(), queue_watcher(), compactor(), screen_refresher()]
+    metrics.register_gauge('piers_queue_depth', db.queue_depth)
+    metrics.register_gauge('piers_clock_correction_milliseconds', lambda: clock_correction)
+    if lostik_settings.RELIABLE_DELIVERY:
+        metrics.register_gauge('piers_unacknowledged_frames', lambda: len(radios[0].retransmit_buffer.frames))
+    metrics.register_gauge('piers_air_time_budget_milliseconds',
+                           lambda: round(sum(radio.airtime_budget.available(scheduler.now()) for radio in radios)))
+    if args.metrics_port != None:
+        tasks.append(metrics.serve(args.metrics_port))
+    if args.metrics_file != None:
+        tasks.append(metrics.write_file(args.metrics_file))
+    await asyncio.gather(*tasks)
+
+#return any message left in flight by a previous run to the outbound queue
+db.requeue_in_flight_messages()
 
 console.show_cursor(False)
 ui.splash()
 ui.lostik_service_static_content()
 ui.lostik_service_insert_firmware_version()
-ui.lostik_service_insert_hweui(HWEUI)
-ui.lostik_service_insert_frequency()
+ui.lostik_service_insert_hweui(', '.join(radio.hweui for radio in radios))
+if args.multi_radio:
+    ui.lostik_service_insert_frequency(', '.join(f'{radio.frequency / 1000000:.3f} MHz' for radio in radios))
+else:
+    ui.lostik_service_insert_frequency(lostik_settings.FREQ_LABEL)
 ui.lostik_service_insert_bandwidth()
 ui.lostik_service_insert_power(PWR_LABEL,PWR_LABEL_DBM,PWR_LABEL_MW)
 ui.lostik_service_insert_spreading_factor()
+for radio in radios[1:]:
+    status.update('spreading_factor', BASE_SF, radio=radio.index)
 ui.lostik_service_insert_coding_rate()
-ui.lostik_service_insert_my_time_slot(MY_TIME_SLOT)
+ui.lostik_service_insert_my_time_slot([radio.my_time_slot for radio in radios])
+status.update('time_sync', TIME_SYNC_ROLE, clock_correction)
 
 #the loop!!!
-while True:
-    try:
-        current_second = datetime.now().second
-        refresh_time_slot(current_second)
-        refresh_tx_window(current_second)
-        if tx_window_open:
-            rowid, message = db.get_next_outbound_message()
-            if rowid != None and message != None:
-                rx(False)
-                time_sent, air_time = tx(message)
-                db.update_sent_outbound_message(rowid,time_sent,air_time)
-            else:
-                #sleep during tx window
-                time.sleep(1.05)
-        else:
-            rx(True)
-            rx_payload = ''
-            while rx_payload == '':
-                current_second = datetime.now().second
-                refresh_time_slot(current_second)
-                refresh_tx_window(current_second)
-                if tx_window_open:
-                    rx(False)
-                    rx_payload = 'tx_window' #fake payload to break from the loop
-                else:
-                    rx_payload = lostik.readline().decode('ASCII').rstrip()
-            else:
-                if rx_payload == 'busy':
-                    console.clear()
-                    console.print('[bright_red][ERROR][/] LoStik busy!')
-                    console.show_cursor(True)
-                    exit(1)
-                elif rx_payload != 'radio_err' and rx_payload != 'tx_window':
-                    rx_payload_list = rx_payload.split()
-                    payload_hex = rx_payload_list[1]
-                    message = bytes.fromhex(payload_hex).decode('ASCII')
-                    rssi = get_rssi()
-                    snr = get_snr()
-                    db.insert_inbound_message(message,rssi,snr)
-    except KeyboardInterrupt:
-        console.print()
-        break
-
-lostik.close()
+profiler = cProfile.Profile() if args.profile != None else None
+try:
+    if profiler != None:
+        profiler.enable()
+    asyncio.run(main())
+except KeyboardInterrupt:
+    console.print()
+finally:
+    if profiler != None:
+        profiler.disable()
+
+for radio in radios:
+    radio.lostik.close()
+db.connection.close()
 console.clear()
 console.show_cursor(True)
+if args.profile_spans:
+    for line in profiling.report():
+        print(line)
+if profiler != None:
+    profiler.dump_stats(args.profile)
+    print(f'cProfile statistics written to {args.profile}')
 exit(0)
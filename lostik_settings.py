@@ -3,11 +3,29 @@
 SET_FREQ = b'923300000'
 FREQ_LABEL = '923.300 MHz'
 
+#Multi-Radio Frequencies
+#with the LoStik Service --multi-radio argument every attached LoStik is used at
+#once, each on its own channel: LoStiks are assigned these frequencies in order
+#of EUI-64 and SET_FREQ is not used, nodes on a channel must share its frequency
+MULTI_RADIO_FREQ = [b'923300000', b'925100000', b'926900000']
+
 #Spreading Factor (hardware default=sf12)
 #values: sf7, sf8, sf9, sf10, sf11, sf12
 SET_SF = b'sf12'
 SF_LABEL = 12
 
+#Adaptive Data Rate (script default=off)
+#when on, transmit at the fastest spreading factor every peer can receive,
+#announced in a beacon sent at SET_SF (see adr.py), nodes always follow the
+#announcements of their peers regardless of this setting
+ADR = False
+#margin (dB) kept above the demodulation floor of the chosen spreading factor
+ADR_MARGIN = 5
+#how long an announced spreading factor stays in force (milliseconds)
+ADR_LEASE = 60000
+#a peer not heard from within this time (milliseconds) forces SET_SF
+ADR_PEER_TIMEOUT = 300000
+
 #Radio Bandwidth (hardware default=125)
 #values: 125, 250, 500
 SET_BW = b'125'
@@ -18,12 +36,119 @@ BW_LABEL = '125 KHz'
 SET_CR = b'4/8'
 CR_LABEL = '4/8'
 
+#Preamble Length (hardware default=8)
+#used by the time-on-air model only, not written to the LoStik
+PREAMBLE_LENGTH = 8
+
+#CRC and Header Mode (hardware default=CRC on, explicit header)
+#used by the time-on-air model only, not written to the LoStik
+CRC = True
+EXPLICIT_HEADER = True
+
+#Maximum Frame Length (bytes)
+#several queued messages are sent together in one frame of up to this length
+#(255 is the RN2903 limit), frames are further limited to the air time left
+#in the time slot by the LoStik Service
+MAX_FRAME_LENGTH = 255
+
+#Message Length (characters)
+#messages longer than FRAGMENT_LENGTH are split into fragments sent one per frame,
+#across TX windows if need be, and reassembled by receivers (see reassembly.py),
+#a fragment must fit in a single TX window at SET_SF and a message may be at
+#most 255 fragments
+MAX_MESSAGE_LENGTH = 500
+FRAGMENT_LENGTH = 50
+#partial messages held for reassembly and time (milliseconds) a partial message
+#is held after its latest fragment arrived
+REASSEMBLY_CAPACITY = 16
+REASSEMBLY_TIMEOUT = 600000
+
+#Frame Encoding (script default=packed)
+#values: packed (6-bit symbols), ascii (for fleets with nodes that predate packing)
+FRAME_ENCODING = 'packed'
+
+#Priority Aging (milliseconds)
+#a queued message is raised one priority level for each interval it has waited
+#so that low priority messages are never starved by higher priority ones
+PRIORITY_AGING = 60000
+
+#Air Time Budget (milliseconds of air time per AIRTIME_BUDGET_PERIOD)
+#enforced by the LoStik Service with a token bucket (see budget.py), messages
+#that would exceed the budget stay queued until enough air time has accrued
+AIRTIME_BUDGET = 360000
+AIRTIME_BUDGET_PERIOD = 3600000
+#maximum air time (milliseconds) used in a single TX window
+AIRTIME_WINDOW_CAP = 5000
+
+#Message Archive
+#messages sent or received more than HOT_RETENTION (milliseconds) ago are moved out
+#of piers.db by the LoStik Service into one archive database per day or month in
+#ARCHIVE_DIRECTORY (see archive.py), message_history.py pages on into the archives
+#values: day, month
+ARCHIVE_PARTITION = 'day'
+ARCHIVE_DIRECTORY = 'archive'
+HOT_RETENTION = 86400000
+#archives are compressed ARCHIVE_COMPRESS_AFTER days after their day or month ends
+#and deleted after ARCHIVE_RETENTION days (None to keep them forever)
+ARCHIVE_COMPRESS_AFTER = 7
+ARCHIVE_RETENTION = 365
+#interval between compactions (milliseconds) and messages moved per transaction
+COMPACTION_INTERVAL = 600000
+COMPACTION_BATCH = 500
+
+#Screen Refresh Interval (milliseconds)
+#the LoStik Service redraws the fields of its screen that changed at most this
+#often, LoStik states shorter than this may not be shown
+SCREEN_REFRESH_INTERVAL = 250
+
 #Firmware Version
 FIRMWARE_VERSION = 'RN2903 1.0.5 Nov 06 2018 10:45:27'
 
 #Time Slot
 TIME_SLOT = {'0004A30B00F1AAC1': 1, '0004A30B00EAC788': 2}
 
+#Number of Time Slots (one per node)
+SLOT_COUNT = 2
+
+#Time Slot Length (milliseconds)
+#must exceed the air time of the longest frame, sub-second slots suit sf7
+SLOT_LENGTH = 5000
+
+#Guard Interval (milliseconds)
+#no transmission during this interval at the start and end of every time slot
+#to absorb clock error between nodes and serial latency
+GUARD_INTERVAL = 50
+
+#Demand-Assigned TDMA (script default=off)
+#when on, every node announces its queue depth at the start of its time slot and
+#the time slots of idle nodes are lent to nodes with a backlog for the next
+#cycle (see dama.py), requires every node to hear every other node and cannot be
+#combined with ADR
+DEMAND_ASSIGNMENT = False
+
+#Reliable Delivery (script default=off)
+#when on, data frames carry a sequence number, every node acknowledges the frames
+#it heard in its own time slot and frames not acknowledged by every node in
+#TIME_SLOT are retransmitted (see reliability.py), enable on every node
+RELIABLE_DELIVERY = False
+#transmissions of a frame before its messages are left unacknowledged
+RETRANSMIT_LIMIT = 4
+
+#Time Synchronization (script default=off)
+#when on, the TDMA clock follows time sync frames broadcast by the node in time
+#slot TIME_SYNC_MASTER rather than the system clock (see timesync.py), so nodes
+#without NTP stay aligned and GUARD_INTERVAL can be reduced
+TIME_SYNC = False
+TIME_SYNC_MASTER = 1
+#interval between time sync frames sent by the master (milliseconds)
+TIME_SYNC_INTERVAL = 60000
+#delay from timestamping a time sync frame until the LoStik begins transmitting
+#and from the end of a frame until radio_rx is read (milliseconds)
+TIME_SYNC_DELAY = 0
+#other nodes hold their transmissions until in sync, but no longer than this
+#after the service starts (milliseconds)
+TIME_SYNC_TIMEOUT = 300000
+
 # #(Globally Unique 64-Bit Identifier (EUI-64)
 # 0004A30B00F1AAC1  <  1
 # 0004A30B00EAC788  <  2
@@ -6,74 +6,256 @@
 #                                                                      #
 ########################################################################
 
+########################################################################
+# History Notes:  Only a screenful of messages is ever loaded or       #
+#                 rendered at a time, so start up cost does not grow   #
+#                 with the size of the message table.  Pages are read  #
+#                 with keyset pagination on rowid and rendered bubbles #
+#                 are cached by rowid.  New messages are appended at   #
+#                 the bottom of the screen as they are sent or         #
+#                 received.  Messages sent with reliable delivery are  #
+#                 marked delivered once every peer has acknowledged    #
+#                 them and unacknowledged until then.  When run in a   #
+#                 terminal, older messages can be paged through        #
+#                 without leaving the viewer, on into the archives of  #
+#                 messages moved out of piers.db (see archive.py):     #
+#                                                                      #
+#                 b or Page Up     older messages                      #
+#                 f or Page Down   newer messages                      #
+#                 l or End         return to the latest messages       #
+########################################################################
+
+#import from required 3rd party libraries
+from rich.console import Group
+from rich.text import Text
+
 #import from project
 from console import console
 import db
+import notify
 
 #import from standard library
+from collections import deque, OrderedDict
 from datetime import datetime
-from time import sleep
-import sqlite3
+from textwrap import wrap
+import os
+import select
+import sys
+import time
+
+#each message bubble is four lines tall, more for a long message wrapped over
+#several lines
+BUBBLE_HEIGHT = 4
+PAGE_SIZE = max(1, (console.height - 1) // BUBBLE_HEIGHT)
+
+#widest line of message text in a bubble
+BUBBLE_WIDTH = max(11, console.width - 4)
+
+#number of rendered bubbles to keep
+BUBBLE_CACHE_SIZE = 8 * PAGE_SIZE
+
+KEYS = {
+    b'b': 'older', b'\x1b[5~': 'older',
+    b'f': 'newer', b'\x1b[6~': 'newer',
+    b'l': 'latest', b'\x1b[F': 'latest', b'\x1b[4~': 'latest', b'\x1bOF': 'latest',
+}
+
+#function: render a message bubble
+# accepts: record (rowid, message, time_sent, air_time, time_received, rssi,
+#          snr, sequence, time_acked)
+# returns: renderable
+def render_bubble(record):
+    message_lines = wrap(record[1], BUBBLE_WIDTH) or [record[1]]
+    message_length = max(11, max(len(message_line) for message_line in message_lines))
+    border_top = '─' * (message_length + 2)
+    border_bottom = '─' * (message_length - 10)
+    if record[2] != None: #outbound message - align right
+        unix_time_sent = int(record[2]) / 1000
+        time_sent = datetime.fromtimestamp(unix_time_sent).strftime('%I:%M:%S %p')
+        lines = [f'[dodger_blue1]╭{border_top}╮[/]']
+        for message_line in message_lines:
+            message_padding = ' ' * (message_length - len(message_line))
+            lines.append(f'[dodger_blue1]│[/] {message_padding}{message_line} [dodger_blue1]│[/]')
+        lines += [
+            f'[dodger_blue1]╰{border_bottom}[/]{time_sent}[dodger_blue1]─┘[/]',
+            f'[bright_black](Air Time: {record[3]}ms)[/]']
+        if record[7] != None and record[8] != None:
+            lines[-1] = f'[green3]Delivered[/]   {lines[-1]}'
+        elif record[7] != None:
+            lines[-1] = f'[yellow]Unacknowledged[/]   {lines[-1]}'
+        justify = 'right'
+    else: #inbound message - align left
+        unix_time_received = int(record[4]) / 1000
+        time_received = datetime.fromtimestamp(unix_time_received).strftime('%I:%M:%S %p')
+        lines = [f'[green3]╭{border_top}╮[/]']
+        for message_line in message_lines:
+            message_padding = ' ' * (message_length - len(message_line))
+            lines.append(f'[green3]│[/] {message_line}{message_padding} [green3]│[/]')
+        lines += [
+            f'[green3]└─[/]{time_received}[green3]{border_bottom}╯[/]',
+            f'[bright_black](RSSI: {str(record[5])}   SNR: {str(record[6])})[/]']
+        justify = 'left'
+    return Group(*[Text.from_markup(line, justify=justify) for line in lines])
+
+#function: obtain a rendered message bubble, rendering it only once
+# accepts: record (see render_bubble)
+# returns: renderable
+#    note: a bubble is rendered again if its delivery state has changed
+def bubble(record):
+    if record[0] in bubble_cache and bubble_cache[record[0]][0] == record:
+        bubble_cache.move_to_end(record[0])
+    else:
+        bubble_cache[record[0]] = (record, render_bubble(record))
+        bubble_cache.move_to_end(record[0])
+        if len(bubble_cache) > BUBBLE_CACHE_SIZE:
+            bubble_cache.popitem(last=False)
+    return bubble_cache[record[0]][1]
+
+#function: determine the newest message that can be shown
+# returns: rowid
+#    note: messages after the oldest queued message are held back until it
+#          is sent so that the history stays in order
+def newest_shown_rowid():
+    first_queued_rowid = db.first_queued_rowid()
+    if first_queued_rowid != None:
+        return first_queued_rowid - 1
+    records = db.history_before(2 ** 63 - 1, 1)
+    return records[0][0] if records else 0
+
+#function: show a page of messages in place of the screen contents
+# accepts: list of records (see render_bubble) and whether it is the latest page
+def show_page(records, latest):
+    console.clear()
+    renderables = [bubble(record) for record in records]
+    if not latest:
+        renderables.append(Text.from_markup(
+            '[bright_black]── b/PgUp older   f/PgDn newer   l/End latest ──[/]', justify='center'))
+    console.print(Group(*renderables))
+
+#function: show the most recent page of messages and resume following new ones
+def show_latest():
+    global rowid_marker, page
+    rowid_marker = newest_shown_rowid()
+    page = db.history_before(rowid_marker + 1, PAGE_SIZE)
+    show_page(page, True)
+
+#function: append newly sent and received messages to the screen
+#    note: only the last screenful is rendered if more than that arrived
+def show_new():
+    global rowid_marker, page
+    records = deque(maxlen=PAGE_SIZE)
+    cursor = db.history_after(rowid_marker)
+    while True:
+        batch = cursor.fetchmany(PAGE_SIZE)
+        for record in batch:
+            if record[2] == None and record[4] == None:
+                batch = []
+                break
+            records.append(record)
+            rowid_marker = record[0]
+        if len(batch) < PAGE_SIZE:
+            break
+    cursor.close()
+    if records:
+        page = (page + list(records))[-PAGE_SIZE:]
+        console.print(Group(*[bubble(record) for record in records]))
+
+#function: show the page again if messages on it have since been acknowledged
+def show_delivery():
+    global page
+    if not any(record[7] != None and record[8] == None for record in page):
+        return
+    records = db.history_before(page[-1][0] + 1, len(page))
+    if records != page:
+        page = records
+        show_page(page, following)
+
+#function: page back or forward through history
+# accepts: 'older', 'newer' or 'latest'
+def scroll(direction):
+    global page, following
+    if direction == 'latest' or not page:
+        following = True
+        show_latest()
+        return
+    if direction == 'older':
+        records = db.history_before(page[0][0], PAGE_SIZE)
+        if not records:
+            return
+        following = False
+        page = records
+        show_page(page, False)
+    else:
+        records = [record for record in db.history_page_after(page[-1][0], PAGE_SIZE) if record[0] <= rowid_marker]
+        if len(records) < PAGE_SIZE:
+            following = True
+            show_latest()
+        else:
+            following = False
+            page = records
+            show_page(page, False)
+
+#function: sleep until notified, a key is pressed or the timeout elapses
+# accepts: timeout in seconds
+# returns: list of keys pressed
+def wait(timeout):
+    files = [file for file in (subscription, keyboard) if file != None]
+    if not files:
+        time.sleep(timeout)
+        return []
+    readable, _, _ = select.select(files, [], [], timeout)
+    if subscription in readable:
+        notify.wait(subscription, 0)
+    if keyboard in readable:
+        key = os.read(keyboard, 16)
+        if key in KEYS:
+            return [KEYS[key]]
+    return []
 
 console.clear()
 console.show_cursor(False)
 
+bubble_cache = OrderedDict()
 rowid_marker = 0
+page = []           #messages on screen, oldest first
+following = True    #False while paging through history
 
-piers_db = sqlite3.connect('piers.db')
-c = piers_db.cursor()
-
-while True:
-    try:    
-        #get all rows with rowid greater than rowid_marker
-        c.execute('''
-            SELECT
-                rowid,
-                message,
-                time_sent,
-                air_time,
-                time_received,
-                rssi,
-                snr
-            FROM
-                messages
-            WHERE
-                rowid>?''',
-            (rowid_marker,))
-        for record in c.fetchall():
-            if record[2] == None and record[4] == None:
-                rowid_marker = int(record[0]) - 1
-                break                        
-            message_length = len(record[1])
-            if message_length <= 11:
-                border_top = '─' * 13
-                border_bottom = '─'
-                message_padding = ' ' * (11 - message_length)
-            else:
-                border_top = '─' * (message_length + 2)
-                border_bottom = '─' * (message_length - 10)
-                message_padding = ''
-            if record[2] != None: #outbound message - align right
-                unix_time_sent = int(record[2]) / 1000
-                time_sent = datetime.fromtimestamp(unix_time_sent).strftime('%I:%M:%S %p')
-                airtime_length = len(str(record[3]))
-                console.print(f'[dodger_blue1]╭{border_top}╮[/]', justify='right')
-                console.print(f'[dodger_blue1]│[/] {message_padding}{record[1]} [dodger_blue1]│[/]', justify='right')
-                console.print(f'[dodger_blue1]╰{border_bottom}[/]{time_sent}[dodger_blue1]─┘[/]', justify='right')
-                console.print(f'[bright_black](Air Time: {record[3]}ms)[/]', justify='right')
-            else: #inbound message - align blue
-                unix_time_received = int(record[4]) / 1000
-                time_received = datetime.fromtimestamp(unix_time_received).strftime('%I:%M:%S %p')
-                console.print(f'[green3]╭{border_top}╮[/]')
-                console.print(f'[green3]│[/] {record[1]}{message_padding} [green3]│[/]')
-                console.print(f'[green3]└─[/]{time_received}[green3]{border_bottom}╯[/]')
-                console.print(f'[bright_black](RSSI: {str(record[5])}   SNR: {str(record[6])})[/]')
-            rowid_marker = record[0]
-        sleep(1)
-    except KeyboardInterrupt:
-        console.print()
-        break
+#wake on notification from the writers, checking data_version as a fallback
+#in case a notification was missed (or notifications are unavailable)
+subscription = notify.subscribe('history')
+if subscription == None:
+    FALLBACK_INTERVAL = 1
+else:
+    FALLBACK_INTERVAL = 10
+last_data_version = db.data_version()
+
+#read single key presses when attached to a terminal
+keyboard = None
+keyboard_settings = None
+if os.name == 'posix' and sys.stdin.isatty():
+    import termios
+    import tty
+    keyboard = sys.stdin.fileno()
+    keyboard_settings = termios.tcgetattr(keyboard)
+    tty.setcbreak(keyboard)
+
+try:
+    show_latest()
+    while True:
+        for direction in wait(FALLBACK_INTERVAL):
+            scroll(direction)
+        current_data_version = db.data_version()
+        if current_data_version == last_data_version:
+            continue
+        last_data_version = current_data_version
+        if following:
+            show_new()
+        show_delivery()
+except KeyboardInterrupt:
+    console.print()
 
-c.close()
-piers_db.close()
+if keyboard_settings != None:
+    termios.tcsetattr(keyboard, termios.TCSADRAIN, keyboard_settings)
+notify.unsubscribe(subscription)
+db.connection.close()
 console.show_cursor(True)
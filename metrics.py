@@ -0,0 +1,230 @@
+########################################################################
+#                                                                      #
+#          NAME:  PiERS Chat - Metrics Functions                       #
+#  DEVELOPED BY:  Chris Clement (K7CTC)                                #
+#       VERSION:  v2.0 (beta)                                          #
+#                                                                      #
+########################################################################
+
+########################################################################
+# Metrics Notes:  Counters and histograms are plain dictionaries held  #
+#                 in memory and updated inline by the LoStik Service,  #
+#                 a dictionary update and (for histograms) a bisect,   #
+#                 so they are cheap enough for every loop iteration.   #
+#                 Rolling rates are derived from short deques of       #
+#                 timestamps and gauges such as the queue depth are    #
+#                 sampled only when the metrics are exported.  The     #
+#                 metrics can be exported as Prometheus text served on #
+#                 localhost, as a JSON file rewritten periodically, or #
+#                 both.  All times are in milliseconds.                #
+########################################################################
+
+#import from standard library
+from bisect import bisect_left
+from collections import deque
+import asyncio
+import json
+import os
+import time
+
+if __name__ == '__main__':
+    print('ERROR: metrics.py is not intended for direct execution!')
+
+#histogram bucket upper bounds (ms)
+HISTOGRAM_BUCKETS = {
+    'piers_serial_round_trip_milliseconds':
+        (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+    'piers_tx_air_time_milliseconds':
+        (25, 50, 100, 200, 400, 800, 1600, 3200, 6400),
+    'piers_queue_wait_milliseconds':
+        (1000, 5000, 10000, 30000, 60000, 300000, 900000, 3600000),
+    'piers_span_milliseconds':
+        (0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000),
+    'piers_loop_phase_milliseconds':
+        (0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000),
+}
+
+HELP = {
+    'piers_loop_iterations_total': 'Radio controller loop iterations',
+    'piers_serial_round_trip_milliseconds': 'Time from writing a LoStik command to its response',
+    'piers_tx_air_time_milliseconds': 'Measured air time of each transmitted frame',
+    'piers_queue_wait_milliseconds': 'Time from enqueue to transmission of each message',
+    'piers_frames_sent_total': 'Frames transmitted',
+    'piers_messages_sent_total': 'Messages transmitted',
+    'piers_frames_received_total': 'Frames received',
+    'piers_decode_errors_total': 'Received frames that could not be decoded',
+    'piers_radio_errors_total': 'radio_err responses from the LoStik',
+    'piers_serial_noise_total': 'Lines from the LoStik holding bytes outside ASCII',
+    'piers_frames_received_per_minute': 'Frames received in the last minute',
+    'piers_duty_cycle_ratio': 'Fraction of the last hour spent transmitting',
+    'piers_queue_depth': 'Messages waiting to be sent',
+    'piers_budget_deferrals_total': 'TX windows in which queued messages were held back by the air time budget',
+    'piers_air_time_budget_milliseconds': 'Air time left in the air time budget',
+    'piers_borrowed_slots_total': 'Time slots of idle nodes used to transmit (demand-assigned TDMA)',
+    'piers_retransmissions_total': 'Frames retransmitted for lack of an acknowledgement',
+    'piers_messages_acknowledged_total': 'Messages acknowledged by every peer',
+    'piers_messages_unacknowledged_total': 'Messages given up after RETRANSMIT_LIMIT transmissions',
+    'piers_duplicate_frames_total': 'Retransmitted frames received again and discarded',
+    'piers_unacknowledged_frames': 'Frames kept for retransmission',
+    'piers_fragments_sent_total': 'Fragments of long messages transmitted',
+    'piers_messages_reassembled_total': 'Long messages reassembled from their fragments',
+    'piers_reassembly_dropped_total': 'Partial messages dropped on timeout or to make room',
+    'piers_time_sync_frames_total': 'Time sync frames sent or used to correct the clock',
+    'piers_clock_correction_milliseconds': 'Total correction applied to the TDMA clock by time synchronization',
+    'piers_messages_archived_total': 'Messages moved out of piers.db into the archives',
+    'piers_span_milliseconds': 'Duration of each call on the hot path (--profile-spans)',
+    'piers_loop_phase_milliseconds': 'Time spent in each phase of a radio controller iteration (--profile-spans)',
+}
+
+#rolling windows (ms)
+RATE_WINDOW = 60000
+DUTY_CYCLE_WINDOW = 3600000
+
+#seconds between rewrites of the JSON file
+EXPORT_INTERVAL = 10
+
+counters = {}       #(name, labels) to value
+histograms = {}     #(name, labels) to [bucket counts, sum, count]
+gauges = {}         #name to function returning the current value
+frames_received = deque()   #time each frame was received
+transmissions = deque()     #(time ended, air time) of each transmission
+
+#function: current time
+# returns: milliseconds on a monotonic clock
+def now():
+    return time.monotonic() * 1000
+
+#function: add to a counter
+# accepts: metric name, labels (for example 'context="tx"') and amount
+def increment(name, labels='', amount=1):
+    key = (name, labels)
+    counters[key] = counters.get(key, 0) + amount
+
+#function: record an observation in a histogram
+# accepts: metric name, value and labels
+def observe(name, value, labels=''):
+    key = (name, labels)
+    histogram = histograms.get(key)
+    if histogram == None:
+        histogram = histograms[key] = [[0] * (len(HISTOGRAM_BUCKETS[name]) + 1), 0, 0]
+    histogram[0][bisect_left(HISTOGRAM_BUCKETS[name], value)] += 1
+    histogram[1] += value
+    histogram[2] += 1
+
+#function: register a gauge sampled when the metrics are exported
+# accepts: metric name and function returning the current value
+def register_gauge(name, function):
+    gauges[name] = function
+
+#function: record a received frame for the rolling receive rate
+def frame_received():
+    frames_received.append(now())
+
+#function: record a transmission for the rolling duty cycle
+# accepts: air time (ms)
+def transmission(air_time):
+    transmissions.append((now(), air_time))
+
+#function: compute the rolling receive rate and duty cycle
+# returns: frames received per minute and duty cycle (0 to 1)
+def rolling_rates():
+    t = now()
+    while frames_received and frames_received[0] < t - RATE_WINDOW:
+        frames_received.popleft()
+    while transmissions and transmissions[0][0] < t - DUTY_CYCLE_WINDOW:
+        transmissions.popleft()
+    air_time = sum(air_time for time_ended, air_time in transmissions)
+    return len(frames_received) * 60000 / RATE_WINDOW, air_time / DUTY_CYCLE_WINDOW
+
+#function: sample every metric
+# returns: dict of metric name to list of (labels, value), histogram values
+#          being dicts of bucket upper bound to cumulative count, sum and count
+def snapshot():
+    metrics = {}
+    for (name, labels), value in sorted(counters.items()):
+        metrics.setdefault(name, []).append((labels, value))
+    for (name, labels), (bucket_counts, total, count) in sorted(histograms.items()):
+        buckets = {}
+        cumulative = 0
+        for bound, bucket_count in zip(HISTOGRAM_BUCKETS[name] + ('+Inf',), bucket_counts):
+            cumulative += bucket_count
+            buckets[str(bound)] = cumulative
+        metrics.setdefault(name, []).append((labels, {'buckets': buckets, 'sum': total, 'count': count}))
+    receive_rate, duty_cycle = rolling_rates()
+    metrics['piers_frames_received_per_minute'] = [('', receive_rate)]
+    metrics['piers_duty_cycle_ratio'] = [('', round(duty_cycle, 6))]
+    for name, function in gauges.items():
+        metrics[name] = [('', function())]
+    return metrics
+
+#function: format every metric in the Prometheus text exposition format
+# returns: text
+def prometheus_text():
+    lines = []
+    for name, samples in snapshot().items():
+        if name in HISTOGRAM_BUCKETS:
+            metric_type = 'histogram'
+        elif name.endswith('_total'):
+            metric_type = 'counter'
+        else:
+            metric_type = 'gauge'
+        lines.append(f'# HELP {name} {HELP.get(name, name)}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for labels, value in samples:
+            if metric_type != 'histogram':
+                lines.append(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}')
+                continue
+            separator = ',' if labels else ''
+            for bound, count in value['buckets'].items():
+                lines.append(f'{name}_bucket{{{labels}{separator}le="{bound}"}} {count}')
+            suffix = f'{{{labels}}}' if labels else ''
+            lines.append(f'{name}_sum{suffix} {value["sum"]}')
+            lines.append(f'{name}_count{suffix} {value["count"]}')
+    return '\n'.join(lines) + '\n'
+
+#function: format every metric as JSON
+# returns: text
+def json_text():
+    metrics = {}
+    for name, samples in snapshot().items():
+        for labels, value in samples:
+            metrics[f'{name}{{{labels}}}' if labels else name] = value
+    return json.dumps({'time': int(round(time.time()*1000)), 'metrics': metrics}, indent=1)
+
+#function: answer a single HTTP request with the Prometheus text
+# accepts: asyncio stream reader and writer
+async def handle_request(reader, writer):
+    try:
+        request = await reader.readline()
+        while (await reader.readline()).strip():
+            pass #discard headers
+        if request.split()[:2] in ([b'GET', b'/metrics'], [b'GET', b'/']):
+            body = prometheus_text().encode('UTF-8')
+            writer.write(b'HTTP/1.0 200 OK\r\n'
+                         b'Content-Type: text/plain; version=0.0.4\r\n'
+                         b'Content-Length: ' + str(len(body)).encode('ASCII') + b'\r\n\r\n' + body)
+        else:
+            writer.write(b'HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n')
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+#task: serve the Prometheus text on localhost
+# accepts: TCP port
+async def serve(port):
+    server = await asyncio.start_server(handle_request, '127.0.0.1', port)
+    async with server:
+        await server.serve_forever()
+
+#task: periodically rewrite a JSON file with every metric
+# accepts: file path
+#    note: the file is replaced atomically so readers never see it half written
+async def write_file(path):
+    while True:
+        temporary_path = f'{path}.tmp'
+        with open(temporary_path, 'w') as file:
+            file.write(json_text())
+        os.replace(temporary_path, path)
+        await asyncio.sleep(EXPORT_INTERVAL)
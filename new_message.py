@@ -6,21 +6,86 @@
 #                                                                      #
 ########################################################################
 
+#import from required 3rd party libraries
+from rich.markup import escape
+
 #import from project
 from console import console
 import db
+import lostik_settings
 import ui
 
 #import from standard library
+from sys import exit
+import argparse
 import re
+import sys
 
 def message_is_valid(message):
-    #only contain A-Z a-z 0-9 . ? ! and between 1 and 50 chars in length
-    if re.fullmatch('^[a-zA-Z0-9!?. ]{1,50}$', message):
+    #only contain A-Z a-z 0-9 . ? ! and between 1 and MAX_MESSAGE_LENGTH chars in length
+    #(messages longer than FRAGMENT_LENGTH are sent in fragments)
+    if re.fullmatch(f'^[a-zA-Z0-9!?. ]{{1,{lostik_settings.MAX_MESSAGE_LENGTH}}}$', message):
         return True
     else:
         return False
 
+#message prefixes to set the priority of a message
+PRIORITY_PREFIXES = {'/urgent ': db.PRIORITY_URGENT, '/low ': db.PRIORITY_LOW}
+
+#function: split a priority prefix from a message
+# accepts: message as typed
+# returns: message and priority
+def message_priority(message):
+    for prefix, priority in PRIORITY_PREFIXES.items():
+        if message.startswith(prefix):
+            return message[len(prefix):], priority
+    return message, db.PRIORITY_NORMAL
+
+#function: queue every valid message read from a file
+# accepts: file object, one message per line
+# returns: number of messages queued and list of (line number, line) rejected
+#    note: blank lines are skipped, valid messages are queued in a single
+#          transaction even if some lines are rejected
+def enqueue_bulk(file):
+    messages = []
+    rejected = []
+    for line_number, line in enumerate(file, 1):
+        line = line.rstrip('\r\n')
+        if line == '':
+            continue
+        message, priority = message_priority(line)
+        if message_is_valid(message):
+            messages.append((message, priority))
+        else:
+            rejected.append((line_number, line))
+    if messages:
+        db.insert_outbound_messages(messages)
+    return len(messages), rejected
+
+#establish and parse command line arguments
+parser = argparse.ArgumentParser(description='PiERS Chat - New Message',
+                                 epilog='Created by K7CTC.')
+parser.add_argument('--bulk',
+                    metavar='FILE',
+                    help='queue one message per line of FILE (- for stdin) without prompting, then exit')
+args = parser.parse_args()
+
+if args.bulk != None:
+    if args.bulk == '-':
+        queued, rejected = enqueue_bulk(sys.stdin)
+    else:
+        try:
+            with open(args.bulk, encoding='ASCII', errors='replace') as file:
+                queued, rejected = enqueue_bulk(file)
+        except OSError as error:
+            console.print(f'[bright_red][ERROR][/] Unable to read {args.bulk}: {error.strerror}')
+            exit(1)
+    for line_number, line in rejected:
+        console.print(f'[bright_red][ERROR][/] Line {line_number} rejected: {escape(line)}')
+    console.print(f'Queued {queued} messages, rejected {len(rejected)}.')
+    db.connection.close()
+    exit(1 if rejected else 0)
+
 console.clear()
 console.show_cursor(False)
 ui.splash()
@@ -31,13 +96,19 @@ while True:
     try:
         ui.move_cursor(6,19)
         message = input()
-        ui.move_cursor(6,19)
-        console.print('                                                              ')
+        if 18 + len(message) >= console.width:
+            #the message wrapped onto the lines below, redraw them
+            ui.new_message_static_content()
+        else:
+            ui.move_cursor(6,19)
+            console.print('                                                              ')
+        message, priority = message_priority(message)
         if message_is_valid(message):
-            db.insert_outbound_message(message)
+            db.insert_outbound_message(message, priority)
         else:
             ui.new_message_invalid()
     except KeyboardInterrupt:
         break
 
+db.connection.close()
 console.clear()
@@ -0,0 +1,94 @@
+########################################################################
+#                                                                      #
+#          NAME:  PiERS Chat - Notification Functions                  #
+#  DEVELOPED BY:  Chris Clement (K7CTC)                                #
+#       VERSION:  v2.0 (beta)                                          #
+#                                                                      #
+########################################################################
+
+########################################################################
+# Notify Notes:  Processes that write to piers.db send a one byte      #
+#                datagram to every subscriber socket found in the      #
+#                piers_notify directory so that readers can sleep      #
+#                until there is something new instead of polling.      #
+#                Notifications are a latency optimization only, a      #
+#                lost datagram is covered by the PRAGMA data_version   #
+#                fallback check performed by the reader.  Unix domain  #
+#                sockets are not available on Windows, in which case   #
+#                subscribe() returns None and readers fall back to     #
+#                polling data_version once per second.                 #
+########################################################################
+
+#import from standard library
+from pathlib import Path
+import os
+import select
+import socket
+import time
+
+if __name__ == '__main__':
+    print('ERROR: notify.py is not intended for direct execution!')
+
+NOTIFY_DIRECTORY = Path('piers_notify')
+NOTIFY_AVAILABLE = hasattr(socket, 'AF_UNIX') and os.name == 'posix'
+
+#function: create a socket to receive notifications on
+# accepts: topic (for example 'history' or 'queue')
+# returns: socket or None if notifications are unavailable
+def subscribe(topic):
+    if not NOTIFY_AVAILABLE:
+        return None
+    NOTIFY_DIRECTORY.mkdir(exist_ok=True)
+    path = NOTIFY_DIRECTORY / f'{topic}-{os.getpid()}.sock'
+    if path.exists():
+        path.unlink()
+    subscription = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    subscription.bind(str(path))
+    subscription.setblocking(False)
+    return subscription
+
+#function: close a subscription and remove its socket file
+# accepts: socket returned by subscribe()
+def unsubscribe(subscription):
+    if subscription == None:
+        return
+    path = Path(subscription.getsockname())
+    subscription.close()
+    if path.exists():
+        path.unlink()
+
+#function: wake every subscriber of a topic
+# accepts: topic
+#    note: never blocks, stale sockets left by crashed readers are removed
+def notify(topic):
+    if not NOTIFY_AVAILABLE or not NOTIFY_DIRECTORY.is_dir():
+        return
+    sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sender.setblocking(False)
+    for path in NOTIFY_DIRECTORY.glob(f'{topic}-*.sock'):
+        try:
+            sender.sendto(b'!', str(path))
+        except (ConnectionRefusedError, FileNotFoundError):
+            if path.exists():
+                path.unlink()
+        except BlockingIOError:
+            pass #subscriber already has notifications pending
+    sender.close()
+
+#function: sleep until notified or until the timeout elapses
+# accepts: socket returned by subscribe() and timeout in seconds
+# returns: True if a notification was received
+def wait(subscription, timeout):
+    if subscription == None:
+        time.sleep(timeout)
+        return False
+    readable, _, _ = select.select([subscription], [], [], timeout)
+    if not readable:
+        return False
+    #drain so that a burst of writes results in a single wake up
+    try:
+        while True:
+            subscription.recv(16)
+    except BlockingIOError:
+        pass
+    return True
@@ -0,0 +1,124 @@
+########################################################################
+#                                                                      #
+#          NAME:  PiERS Chat - Profiling Functions                     #
+#  DEVELOPED BY:  Chris Clement (K7CTC)                                #
+#       VERSION:  v2.0 (beta)                                          #
+#                                                                      #
+########################################################################
+
+########################################################################
+# Profiling Notes:  With the LoStik Service --profile-spans argument   #
+#                   the functions on the hot path (radio control, the  #
+#                   database and UI drawing) are replaced at startup   #
+#                   by wrappers timing every call, and each iteration  #
+#                   of a radio controller is split into the time spent #
+#                   waiting for an event and the time spent handling   #
+#                   it.  Spans and loop phases are exported with the   #
+#                   other metrics and summarized on exit.  Without the #
+#                   argument nothing is wrapped and the loop phases    #
+#                   cost one test of a flag, so the service runs as    #
+#                   fast as before.  A span of a coroutine includes    #
+#                   the time it spent awaiting the LoStik, and a span  #
+#                   includes any spans nested within it.               #
+########################################################################
+
+#import from project library
+import metrics
+
+#import from standard library
+import asyncio
+import functools
+import inspect
+import time
+
+if __name__ == '__main__':
+    print('ERROR: profiling.py is not intended for direct execution!')
+
+enabled = False
+spans = {}    #(metric name, span or phase) to [count, total, maximum] (ms)
+
+#function: start timing spans and loop phases
+def enable():
+    global enabled
+    enabled = True
+
+#function: record the duration of a span or loop phase
+# accepts: metric name, span or phase name and duration (ms)
+def record(name, span, duration):
+    statistics = spans.get((name, span))
+    if statistics == None:
+        statistics = spans[(name, span)] = [0, 0, 0]
+    statistics[0] += 1
+    statistics[1] += duration
+    statistics[2] = max(statistics[2], duration)
+    metrics.observe(name, duration, f'span="{span}"')
+
+#function: wrap a function so that every call is timed
+# accepts: function (plain or coroutine) and span name
+# returns: wrapper
+def timed(function, span):
+    if asyncio.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                record('piers_span_milliseconds', span, (time.perf_counter() - start) * 1000)
+    else:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record('piers_span_milliseconds', span, (time.perf_counter() - start) * 1000)
+    return wrapper
+
+#function: time every call of the functions defined in a module
+# accepts: module and optionally the prefix of the function names to time
+#    note: calls made through a reference taken before this point are not
+#          timed
+def instrument_module(module, prefix=''):
+    name = module.__name__
+    for function_name, function in inspect.getmembers(module, inspect.isfunction):
+        if function.__module__ == name and function_name.startswith(prefix):
+            setattr(module, function_name, timed(function, f'{name}.{function_name}'))
+
+#function: time every call of methods of a class
+# accepts: class and method names
+def instrument_methods(cls, method_names):
+    for method_name in method_names:
+        setattr(cls, method_name, timed(getattr(cls, method_name), f'{cls.__name__}.{method_name}'))
+
+#function: start timing a loop phase
+# returns: time.perf_counter(), or None if profiling is not enabled
+def phase_start():
+    if enabled:
+        return time.perf_counter()
+
+#function: end a loop phase and start the next
+# accepts: phase name and value returned by phase_start() or phase()
+# returns: start of the next phase
+def phase(name, start):
+    if not enabled:
+        return None
+    now = time.perf_counter()
+    record('piers_loop_phase_milliseconds', name, (now - start) * 1000)
+    return now
+
+#function: summarize the spans and loop phases recorded
+# returns: list of lines, slowest in total first
+def report():
+    lines = []
+    for name, title in (('piers_loop_phase_milliseconds', 'Loop Phase'), ('piers_span_milliseconds', 'Span')):
+        recorded = sorted(((span, statistics) for (metric_name, span), statistics in spans.items() if metric_name == name),
+                          key=lambda item: item[1][1], reverse=True)
+        if not recorded:
+            continue
+        width = max(len(title), *(len(span) for span, statistics in recorded))
+        lines.append(f'{title:<{width}}  {"Count":>8}  {"Total ms":>10}  {"Mean ms":>9}  {"Max ms":>9}')
+        for span, (count, total, maximum) in recorded:
+            lines.append(f'{span:<{width}}  {count:>8}  {total:>10.1f}  {total / count:>9.3f}  {maximum:>9.3f}')
+        lines.append('')
+    return lines
@@ -0,0 +1,62 @@
+########################################################################
+#                                                                      #
+#          NAME:  PiERS Chat - Queue Wait Report                       #
+#  DEVELOPED BY:  Chris Clement (K7CTC)                                #
+#       VERSION:  v2.0 (beta)                                          #
+#                                                                      #
+########################################################################
+
+########################################################################
+# Queue Wait Notes:  A message waits in the outbound queue from the    #
+#                    moment new_message.py queues it (time_queued)     #
+#                    until the frame carrying it has been transmitted  #
+#                    (time_sent).  With an empty queue the wait is     #
+#                    bounded by one TDMA cycle plus the air time of    #
+#                    the frame, waits well beyond that mean the TX     #
+#                    window is too short for the traffic offered.      #
+########################################################################
+
+#import from project library
+import db
+import lostik_settings
+
+#import from standard library
+import argparse
+from math import ceil
+import time
+
+#function: compute a percentile by the nearest rank method
+# accepts: sorted list of values and percentile (0 to 100)
+# returns: value
+def percentile(values, p):
+    return values[max(ceil(p / 100 * len(values)) - 1, 0)]
+
+#establish and parse command line arguments
+parser = argparse.ArgumentParser(description='PiERS Chat - Queue Wait Report',
+                                 epilog='Created by K7CTC.')
+parser.add_argument('--hours',
+                    type=float,
+                    help='report on messages sent in the last number of hours (default: 24)',
+                    default=24)
+args = parser.parse_args()
+
+since = int(round((time.time() - args.hours * 3600) * 1000))
+waits = {}
+for priority, wait in db.queue_wait_times(since):
+    waits.setdefault(priority, []).append(wait)
+    waits.setdefault(None, []).append(wait)
+
+cycle_length = lostik_settings.SLOT_COUNT * lostik_settings.SLOT_LENGTH
+print(f'TDMA cycle: {cycle_length}ms ({lostik_settings.SLOT_COUNT} slots of {lostik_settings.SLOT_LENGTH}ms)')
+if not waits:
+    print(f'No messages sent in the last {args.hours:g} hours.')
+else:
+    print('  Priority   Messages        p50        p95        p99        max')
+    for priority in sorted(waits, key=lambda priority: -1 if priority == None else priority, reverse=True):
+        values = waits[priority]
+        label = 'all' if priority == None else db.PRIORITY_NAMES.get(priority, str(priority))
+        print(f'{label:>10} {len(values):>10} '
+              f'{percentile(values, 50):>8}ms {percentile(values, 95):>8}ms '
+              f'{percentile(values, 99):>8}ms {values[-1]:>8}ms')
+
+db.connection.close()
@@ -0,0 +1,73 @@
+########################################################################
+#                                                                      #
+#          NAME:  PiERS Chat - Message Reassembly                      #
+#  DEVELOPED BY:  Chris Clement (K7CTC)                                #
+#       VERSION:  v2.0 (beta)                                          #
+#                                                                      #
+########################################################################
+
+########################################################################
+# Reassembly Notes:  A message longer than FRAGMENT_LENGTH arrives as  #
+#                    fragment frames spread over one or more of the    #
+#                    sender's TX windows.  Fragments are held in       #
+#                    memory, keyed by sender and message id, until     #
+#                    every fragment has arrived and the message is     #
+#                    passed on whole.  The buffer is bounded: a        #
+#                    partial message is dropped once no fragment of it #
+#                    has arrived for REASSEMBLY_TIMEOUT, and the least #
+#                    recently updated partial message is dropped to    #
+#                    make room when REASSEMBLY_CAPACITY are held.  A   #
+#                    message is at most 255 fragments, so no partial   #
+#                    message can grow without limit either.            #
+########################################################################
+
+#import from standard library
+from collections import OrderedDict
+
+if __name__ == '__main__':
+    print('ERROR: reassembly.py is not intended for direct execution!')
+
+class ReassemblyBuffer:
+    #accepts: maximum number of partial messages and time (ms) a partial
+    #         message is held after its last fragment arrived
+    def __init__(self, capacity, timeout):
+        if capacity <= 0 or timeout <= 0:
+            raise ValueError('reassembly capacity and timeout must be positive')
+        self.capacity = capacity
+        self.timeout = timeout
+        self.messages = OrderedDict()  #(sender, message id) to partial message, least recent first
+        self.dropped = 0               #partial messages timed out or evicted
+
+    #function: drop partial messages that have timed out
+    # accepts: time (ms)
+    def expire(self, now):
+        while self.messages:
+            key, message = next(iter(self.messages.items()))
+            if now - message['time_updated'] < self.timeout:
+                break
+            del self.messages[key]
+            self.dropped += 1
+
+    #function: add a received fragment
+    # accepts: sender, message id, fragment index, fragment count, fragment
+    #          and time received (ms)
+    # returns: the whole message once every fragment has arrived, else None
+    #    note: a fragment whose count disagrees with the fragments already
+    #          held starts the message over, the message id was reused
+    def add(self, sender, message_id, index, count, fragment, now):
+        self.expire(now)
+        key = (sender, message_id)
+        message = self.messages.get(key)
+        if message == None or message['count'] != count:
+            message = {'count': count, 'fragments': {}}
+            self.messages[key] = message
+        message['fragments'][index] = fragment
+        message['time_updated'] = now
+        self.messages.move_to_end(key)
+        if len(message['fragments']) == count:
+            del self.messages[key]
+            return ''.join(message['fragments'][index] for index in range(count))
+        while len(self.messages) > self.capacity:
+            self.messages.popitem(last=False)
+            self.dropped += 1
+        return None
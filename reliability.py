@@ -0,0 +1,156 @@
+########################################################################
+#                                                                      #
+#          NAME:  PiERS Chat - Reliable Delivery                       #
+#  DEVELOPED BY:  Chris Clement (K7CTC)                                #
+#       VERSION:  v2.0 (beta)                                          #
+#                                                                      #
+########################################################################
+
+########################################################################
+# Reliability Notes:  Each data frame carries a one byte sequence      #
+#                     number.  A receiver remembers, per sender, the   #
+#                     highest sequence number heard and a 16-bit       #
+#                     bitmap of that and the 15 before it.  In its own #
+#                     TX window it returns the pair in a single ACK    #
+#                     frame holding one 4 byte entry per sender, so    #
+#                     one frame acknowledges a whole window of frames  #
+#                     from every peer at once.                         #
+#                                                                      #
+#                     The sender keeps each frame until every peer has #
+#                     acknowledged it.  A frame still unacknowledged   #
+#                     once every peer has had a time slot since it was #
+#                     sent is retransmitted unchanged, with the same   #
+#                     sequence number so that receivers can discard    #
+#                     duplicates, and is given up after                #
+#                     RETRANSMIT_LIMIT transmissions.  No more than    #
+#                     WINDOW frames are kept, further messages stay    #
+#                     queued until the oldest frame is acknowledged or #
+#                     given up, so every frame kept can be covered by  #
+#                     a bitmap.  A message sent in fragments is        #
+#                     acknowledged once every fragment is, and is left #
+#                     unacknowledged if any fragment is given up.      #
+########################################################################
+
+#import from standard library
+from collections import OrderedDict
+
+if __name__ == '__main__':
+    print('ERROR: reliability.py is not intended for direct execution!')
+
+#frames covered by an acknowledgement and kept for retransmission
+WINDOW = 16
+
+#function: record a sequence number received from a sender
+# accepts: sender's receive window, (highest sequence number, bitmap) or None
+#          if nothing has been heard, and the sequence number received
+# returns: updated receive window and True unless the frame is a duplicate
+#    note: a sequence number too far behind to be a retransmission means the
+#          sender started over (after a restart) and begins a new window
+def receive_sequence(window, sequence):
+    if window == None:
+        return (sequence, 1), True
+    last, bitmap = window
+    ahead = (sequence - last) % 256
+    if 0 < ahead < 128:
+        return (sequence, ((bitmap << ahead) | 1) & 0xFFFF), True
+    behind = (last - sequence) % 256
+    if behind >= WINDOW:
+        return (sequence, 1), True
+    if bitmap & (1 << behind):
+        return window, False
+    return (last, bitmap | (1 << behind)), True
+
+#function: determine if a receive window covers a sequence number
+# accepts: highest sequence number, bitmap and sequence number
+# returns: boolean
+def acknowledged(last, bitmap, sequence):
+    behind = (last - sequence) % 256
+    return behind < WINDOW and bitmap & (1 << behind) != 0
+
+class RetransmitBuffer:
+    #accepts: time slots of the peers that must acknowledge every frame and
+    #         the last sequence number sent (None to start at 0)
+    def __init__(self, peers, last_sequence=None):
+        self.peers = frozenset(peers)
+        self.next_sequence = 0 if last_sequence == None else (last_sequence + 1) % 256
+        self.frames = OrderedDict()  #sequence number to frame, oldest first
+        self.complete = set()        #rowids of messages sent in full
+        self.failed = set()          #rowids of messages with a fragment given up
+
+    #function: determine if another frame may be sent
+    # returns: boolean
+    def full(self):
+        return len(self.frames) >= WINDOW
+
+    #function: keep a frame that was just sent until it is acknowledged
+    # accepts: sequence number, payload, rowids of its messages, time sent (ms)
+    #          and False for a fragment frame that does not complete its message
+    def add(self, sequence, payload, rowids, time_sent, complete=True):
+        self.frames[sequence] = {'payload': payload,
+                                 'rowids': rowids,
+                                 'pending': set(self.peers),
+                                 'transmissions': 1,
+                                 'time_sent': time_sent}
+        self.next_sequence = (sequence + 1) % 256
+        if complete:
+            self.complete.update(rowids)
+
+    #function: settle the messages of frames no longer kept
+    # accepts: rowids
+    # returns: list of rowids of messages acknowledged by every peer
+    #    note: a message is settled once sent in full and none of its
+    #          fragments remain to be acknowledged
+    def settle(self, rowids):
+        outstanding = set()
+        for frame in self.frames.values():
+            outstanding.update(frame['rowids'])
+        delivered = []
+        for rowid in set(rowids):
+            if rowid not in self.complete or rowid in outstanding:
+                continue
+            self.complete.discard(rowid)
+            if rowid in self.failed:
+                self.failed.discard(rowid)
+            else:
+                delivered.append(rowid)
+        return delivered
+
+    #function: apply an acknowledgement from a peer
+    # accepts: peer and its receive window for my frames
+    # returns: list of rowids of messages now acknowledged by every peer
+    def acknowledge(self, peer, last, bitmap):
+        acknowledged_rowids = []
+        for sequence, frame in list(self.frames.items()):
+            if acknowledged(last, bitmap, sequence):
+                frame['pending'].discard(peer)
+            if not frame['pending']:
+                acknowledged_rowids += frame['rowids']
+                del self.frames[sequence]
+        return self.settle(acknowledged_rowids)
+
+    #function: find the frames that must be retransmitted
+    # accepts: time (ms), time (ms) every peer needs to acknowledge a frame
+    #          and maximum transmissions of a frame
+    # returns: list of (sequence number, payload) to retransmit and list of
+    #          rowids of messages given up as unacknowledged
+    def due(self, now, interval, limit):
+        retransmissions = []
+        abandoned = []
+        for sequence, frame in list(self.frames.items()):
+            if now - frame['time_sent'] < interval:
+                continue
+            if frame['transmissions'] >= limit:
+                abandoned += [rowid for rowid in frame['rowids'] if rowid not in self.failed]
+                self.failed.update(frame['rowids'])
+                del self.frames[sequence]
+                self.settle(frame['rowids'])
+            else:
+                retransmissions.append((sequence, frame['payload']))
+        return retransmissions, abandoned
+
+    #function: record the retransmission of a frame
+    # accepts: sequence number and time sent (ms)
+    def retransmitted(self, sequence, time_sent):
+        if sequence in self.frames:
+            self.frames[sequence]['transmissions'] += 1
+            self.frames[sequence]['time_sent'] = time_sent
@@ -0,0 +1,88 @@
+########################################################################
+#                                                                      #
+#          NAME:  PiERS Chat - Serial Trace                            #
+#  DEVELOPED BY:  Chris Clement (K7CTC)                                #
+#       VERSION:  v2.0 (beta)                                          #
+#                                                                      #
+########################################################################
+
+########################################################################
+# Trace Notes:  A trace holds every line exchanged between the LoStik  #
+#               Service and a LoStik, in order, so that a session can  #
+#               be studied or replayed later (see lostik_replay.py).   #
+#               The file begins with TRACE_MAGIC and each line is one  #
+#               record: a kind byte, the time.monotonic() it was       #
+#               written or read in microseconds since the first record #
+#               (8 bytes), the line length (2 bytes) and the line      #
+#               without its terminator.  Lines read from the LoStik    #
+#               are stored with the kind the driver routed them as, so #
+#               a replay can tell a response from a received frame.    #
+########################################################################
+
+#import from standard library
+import atexit
+import struct
+import threading
+
+if __name__ == '__main__':
+    print('ERROR: serial_trace.py is not intended for direct execution!')
+
+TRACE_MAGIC = b'PIERSTRACE\x01'
+
+#record kinds
+TRACE_COMMAND = 1   #command written to the LoStik
+TRACE_RESPONSE = 2  #response to a command
+TRACE_TX = 3        #radio_tx_ok or radio_err completing a transmission
+TRACE_RX = 4        #radio_rx or radio_err while receiving
+
+RECORD_HEADER = struct.Struct('<BQH')
+
+class TraceWriter:
+    #accepts: path of the trace file to create
+    #   note: raises OSError if the file cannot be created
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(TRACE_MAGIC)
+        self.start = None
+        self.lock = threading.Lock()  #records come from the event loop and the reader thread
+        atexit.register(self.close)
+
+    #function: append a record
+    # accepts: kind, time.monotonic() written or read and line (str or bytes)
+    def record(self, kind, monotonic, line):
+        if isinstance(line, str):
+            line = line.encode('ASCII', errors='replace')
+        with self.lock:
+            if self.file.closed:
+                return
+            if self.start == None:
+                self.start = monotonic
+            self.file.write(RECORD_HEADER.pack(kind, max(round((monotonic - self.start) * 1000000), 0), len(line)))
+            self.file.write(line)
+
+    #function: flush and close the trace file
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+#function: read a trace file
+# accepts: path
+# returns: list of (kind, time in seconds since the first record, line)
+#    note: raises ValueError if the file is not a trace, a record cut short
+#          by a crash ends the trace
+def read_trace(path):
+    with open(path, 'rb') as file:
+        data = file.read()
+    if not data.startswith(TRACE_MAGIC):
+        raise ValueError(f'{path} is not a PiERS serial trace')
+    records = []
+    offset = len(TRACE_MAGIC)
+    while offset + RECORD_HEADER.size <= len(data):
+        kind, microseconds, length = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        if offset + length > len(data):
+            break
+        records.append((kind, microseconds / 1000000, data[offset:offset + length].decode('ASCII', errors='replace')))
+        offset += length
+    return records
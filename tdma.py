@@ -0,0 +1,85 @@
+########################################################################
+#                                                                      #
+#          NAME:  PiERS Chat - TDMA Scheduler                          #
+#  DEVELOPED BY:  Chris Clement (K7CTC)                                #
+#       VERSION:  v2.0 (beta)                                          #
+#                                                                      #
+########################################################################
+
+########################################################################
+# TDMA Notes:  Time is divided into a repeating cycle of equal length  #
+#              time slots, one per node, numbered from 1.  Slots are   #
+#              aligned to the Unix epoch so every node with an         #
+#              accurate clock agrees on slot boundaries without any    #
+#              coordination.  A node may transmit only during its own  #
+#              slot, less a guard interval at either end to absorb     #
+#              clock error between nodes.  All times are integer       #
+#              milliseconds on a monotonic clock anchored once to the  #
+#              system clock, so a system clock step while the service  #
+#              is running cannot move slot boundaries.  When time      #
+#              synchronization is enabled (see timesync.py) the clock  #
+#              is corrected to that of the time sync master instead.   #
+########################################################################
+
+#import from standard library
+import time
+
+if __name__ == '__main__':
+    print('ERROR: tdma.py is not intended for direct execution!')
+
+class TdmaScheduler:
+    #accepts: my time slot, number of slots, slot length and guard interval (ms)
+    def __init__(self, my_time_slot, slot_count, slot_length, guard_interval):
+        if not 1 <= my_time_slot <= slot_count:
+            raise ValueError(f'time slot {my_time_slot} is outside of 1 to {slot_count}')
+        if slot_length <= 2 * guard_interval:
+            raise ValueError('guard intervals leave no time to transmit')
+        self.my_time_slot = my_time_slot
+        self.slot_count = slot_count
+        self.slot_length = slot_length
+        self.guard_interval = guard_interval
+        self.clock_offset = round(time.time() * 1000 - time.monotonic() * 1000)
+
+    #function: obtain the current time, or the time of a past time.monotonic() reading
+    # accepts: optionally a time.monotonic() reading (seconds)
+    # returns: milliseconds since the Unix epoch
+    def now(self, monotonic=None):
+        if monotonic == None:
+            monotonic = time.monotonic()
+        return int(monotonic * 1000) + self.clock_offset
+
+    #function: correct the clock
+    # accepts: correction (ms, positive to advance the clock)
+    def adjust(self, correction):
+        self.clock_offset += correction
+
+    #function: determine the time slot in progress
+    # accepts: time (ms)
+    # returns: time slot
+    def time_slot(self, t):
+        return (t // self.slot_length) % self.slot_count + 1
+
+    #function: determine the cycle in progress
+    # accepts: time (ms)
+    # returns: cycle number (cycles since the Unix epoch)
+    def cycle(self, t):
+        return t // (self.slot_count * self.slot_length)
+
+    #function: obtain the start of the time slot in progress
+    # accepts: time (ms)
+    # returns: time (ms)
+    def slot_start(self, t):
+        return t - t % self.slot_length
+
+    #function: obtain the start of the next time slot (of any node)
+    # accepts: time (ms)
+    # returns: time (ms)
+    def next_slot_start(self, t):
+        return (t // self.slot_length + 1) * self.slot_length
+
+    #function: obtain the TX window of a time slot
+    # accepts: start time of the time slot (ms)
+    # returns: window open and close times (ms), the time slot less a guard
+    #          interval at either end
+    def tx_window(self, slot_start):
+        return slot_start + self.guard_interval, slot_start + self.slot_length - self.guard_interval
@@ -0,0 +1,47 @@
+########################################################################
+#                                                                      #
+#          NAME:  PiERS Chat - Time Synchronization                    #
+#  DEVELOPED BY:  Chris Clement (K7CTC)                                #
+#       VERSION:  v2.0 (beta)                                          #
+#                                                                      #
+########################################################################
+
+########################################################################
+# Time Sync Notes:  TDMA only works if every node agrees on where the  #
+#                   slot boundaries are.  Rather than relying on each  #
+#                   host's clock, one node (the master) periodically   #
+#                   broadcasts its clock in a time sync frame at the   #
+#                   start of its TX window.  A receiver knows when the #
+#                   frame ended (the radio_rx line), and the frame's   #
+#                   air time is known from its length, so the master's #
+#                   clock at that moment is the timestamp plus the air #
+#                   time plus a fixed delay for serial transfer and    #
+#                   radio start up (TIME_SYNC_DELAY).  The difference  #
+#                   from the local clock is one sample of the offset.  #
+#                   The median of recent samples is applied to the     #
+#                   TDMA clock, which rejects the odd late delivery.   #
+#                   Samples are kept relative to the corrected clock,  #
+#                   so once in sync each correction is only the drift  #
+#                   since the previous time sync frame.                #
+########################################################################
+
+#import from standard library
+from statistics import median
+
+if __name__ == '__main__':
+    print('ERROR: timesync.py is not intended for direct execution!')
+
+#number of recent offset samples used to estimate the correction
+SAMPLE_COUNT = 5
+
+#function: estimate the correction to apply to my clock
+# accepts: deque of recent samples (maxlen SAMPLE_COUNT), the master's time
+#          in the time sync frame, its air time, the fixed delay and the
+#          local time the frame was received (all ms)
+# returns: correction (ms, positive to advance my clock)
+def clock_correction(samples, timestamp, air_time, delay, time_received):
+    samples.append(timestamp + delay + air_time - time_received)
+    correction = round(median(samples))
+    for index in range(len(samples)):
+        samples[index] -= correction
+    return correction
@@ -6,6 +6,9 @@
 #                                                                      #
 ########################################################################
 
+#import from required 3rd party libraries
+from rich.control import Control
+
 #import from project library
 from console import console
 import lostik_settings
@@ -13,10 +16,8 @@ import lostik_settings
 #import from standard library
 from time import sleep
 
-total_air_time = 0
-
 def move_cursor(row, column):
-    print(f'\033[{row};{column}H', end='')
+    console.control(Control.move_to(column - 1, row - 1))
 
 def lostik_service_static_content():
     console.clear()
@@ -32,18 +33,21 @@ def lostik_service_static_content():
     console.print('Current Time Slot:')
     console.print('     LoStik State:')
     console.print('   Total Air Time:')
+    console.print('  Air Time Budget:')
+    console.print('        Time Sync:')
     console.print()
     console.print('[grey30]Press CTRL+C to quit.[/]')
 
 def new_message_static_content():
     console.clear()
     console.print('[white on deep_sky_blue4] ⣿ PiERS Chat v2.0 (beta)  ❭❭❭  New Message                                     [/]')
-    console.print('Type a message between 1 and 50 characters then press enter. Your message may   ')
+    console.print(f'Type a message of up to {lostik_settings.MAX_MESSAGE_LENGTH} characters then press enter. Your message may'.ljust(80))
     console.print('only contain A-Z a-Z 0-9 and the following special characters:                  ')
     console.print('period, question mark and exclamation mark                                      ')
     console.print('[deep_sky_blue4]━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━[/]')
     console.print('Outbound Message:')
     console.print()
+    console.print('[grey30]Start a message with /urgent or /low to change its priority.[/]')
     console.print('[grey30]Press CTRL+C to quit.[/]')
 
 def new_message_invalid():
@@ -63,9 +67,9 @@ def lostik_service_insert_hweui(hweui):
     move_cursor(3,20)
     console.print(hweui)
 
-def lostik_service_insert_frequency():
+def lostik_service_insert_frequency(frequency_label):
     move_cursor(4,20)
-    console.print(lostik_settings.FREQ_LABEL)
+    console.print(frequency_label)
 
 def lostik_service_insert_bandwidth():
     move_cursor(5,20)
@@ -79,28 +83,30 @@ def lostik_service_insert_spreading_factor():
     move_cursor(7,20)
     console.print(lostik_settings.SF_LABEL)
 
+def lostik_service_update_spreading_factor(sf, radio=0):
+    move_cursor(7,20 + 4 * radio)
+    console.print(f'{sf}  ')
+
 def lostik_service_insert_coding_rate():
     move_cursor(8,20)
     console.print(lostik_settings.CR_LABEL)
 
-def lostik_service_insert_my_time_slot(my_time_slot):
+def lostik_service_insert_my_time_slot(my_time_slots):
     move_cursor(9,20)
-    if my_time_slot == 1:
-        console.print('TS1')
-    elif my_time_slot == 2:
-        console.print('TS2')
+    console.print(', '.join(f'TS{my_time_slot}' for my_time_slot in my_time_slots))
 
-def lostik_service_update_current_time_slot(current_time_slot):
+def lostik_service_update_current_time_slot(current_time_slot, slot_count):
     move_cursor(10,20)
-    if current_time_slot == 1:
-        console.print('TS1', style='r', end='')
-        console.print(' TS2')
-    elif current_time_slot == 2:
-        console.print('TS1 ', end='')
-        console.print('TS2', style='r')
+    for time_slot in range(1, slot_count + 1):
+        if time_slot == current_time_slot:
+            console.print(f'TS{time_slot}', style='r', end='')
+        else:
+            console.print(f'TS{time_slot}', end='')
+        console.print(' ', end='')
+    console.print()
  
-def lostik_service_update_lostik_state(state):
-    move_cursor(11,20)
+def lostik_service_update_lostik_state(state, radio=0):
+    move_cursor(11,20 + 2 * radio)
     if state == 'tx':
         console.print('[bright_red]●[/]')
     elif state == 'rx':
@@ -108,13 +114,75 @@ def lostik_service_update_lostik_state(state):
     elif state == 'idle':
         console.print('[bright_black]◌[/]')
 
-def lostik_service_update_total_air_time(last_tx_air_time):
+def lostik_service_update_total_air_time(total_air_time):
     move_cursor(12,20)
-    global total_air_time
-    total_air_time += last_tx_air_time
     total_air_time_seconds = total_air_time / 1000
     console.print(f'{total_air_time_seconds} seconds')
    
+def lostik_service_update_air_time_budget(available, capacity, deferring):
+    move_cursor(13,20)
+    if deferring:
+        console.print(f'{available / 1000:.1f} of {capacity / 1000:.1f} seconds [bright_yellow](deferring)[/]  ')
+    else:
+        console.print(f'{available / 1000:.1f} of {capacity / 1000:.1f} seconds              ')
+
+def lostik_service_update_time_sync(role, clock_correction):
+    move_cursor(14,20)
+    if role == None:
+        console.print('off')
+    elif role == 'master':
+        console.print('master')
+    else:
+        console.print(f'following ({clock_correction:+d}ms)        ')
+
+########################################################################
+# Status Notes:  The LoStik Service does not draw its screen as events #
+#                happen.  The radio loop only records the latest value #
+#                of each field in a ServiceStatus, which remembers the #
+#                fields that changed, and a separate task draws those  #
+#                fields at most once per SCREEN_REFRESH_INTERVAL.  A   #
+#                field that changes several times between two redraws  #
+#                is drawn once and a field set to the value already on #
+#                screen is not drawn at all, so terminal output stays  #
+#                small over a slow SSH link.  Each redraw is written   #
+#                in a single write.                                    #
+########################################################################
+
+class ServiceStatus:
+    def __init__(self):
+        self.values = {}  #(field, radio) to arguments of the function drawing it
+        self.dirty = []   #fields changed since the last redraw, in order of change
+
+    #function: change a field of the LoStik Service screen
+    # accepts: field (name of its lostik_service_update_ function without the
+    #          prefix), the arguments to draw it with and, for fields shown
+    #          per LoStik, the position of the radio
+    def update(self, field, *args, radio=None):
+        key = (field, radio)
+        if self.values.get(key) != args:
+            self.values[key] = args
+            if key not in self.dirty:
+                self.dirty.append(key)
+
+    #function: take the fields to redraw
+    # returns: list of (field, arguments, radio), empty if nothing changed
+    def changes(self):
+        changes = [(field, self.values[(field, radio)], radio) for field, radio in self.dirty]
+        self.dirty = []
+        return changes
+
+#function: draw changed fields of the LoStik Service screen
+# accepts: list of changes from ServiceStatus.changes()
+#    note: blocking, the LoStik Service runs it on a worker thread
+def lostik_service_redraw(changes):
+    with console:
+        for field, args, radio in changes:
+            draw = globals()[f'lostik_service_update_{field}']
+            if radio == None:
+                draw(*args)
+            else:
+                draw(*args, radio)
+
 def splash():
     move_cursor(15,27)
     console.print('[grey70]C h r i s    C l e m e n t[/]') 